@@ -134,9 +134,10 @@ def score_mixturemean(train,test,mask,step=-1e-3,iters=100):
     return rmse(pred,test,mask)
 
 
-def score_svdmethod(train,test,mask,tau=6e3,step=1.9,fixstep=True,iters=250):
+def score_svdmethod(train,test,mask,tau=6e3,step=1.9,fixstep=True,iters=250,
+                    warm=True):
     # Define Domain
-    Domain = SVDMethod(Data=train,tau=tau)
+    Domain = SVDMethod(Data=train,tau=tau,warm=warm)
 
     # Set Method
     # Method = Euler(Domain=Domain,FixStep=fixstep)
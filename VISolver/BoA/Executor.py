@@ -0,0 +1,139 @@
+from __future__ import division
+import math
+import numpy as np
+
+try:
+    # pathos pickles with dill, so lambdas/closures in sim args are ok
+    from pathos.pools import _ProcessPool as Pool
+except ImportError:
+    from multiprocessing import Pool
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+
+# Per-worker state, populated once by the pool initializer
+_worker = {}
+
+
+def _attach(name,shape,dtype):
+    # The parent owns the segment - attach without registering it with the
+    # resource tracker so worker exit neither unlinks nor reports a leak
+    try:
+        shm = shared_memory.SharedMemory(name=name,track=False)
+    except TypeError:  # python < 3.13
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+    return shm, np.ndarray(shape,dtype=dtype,buffer=shm.buf)
+
+
+def _init_worker(le,sim,args,shared,consts):
+    _worker.clear()
+    _worker['le'] = le
+    _worker['sim'] = sim
+    _worker['args'] = args
+    _worker['consts'] = consts
+    for key,(name,shape,dtype) in shared.items():
+        _worker[key+'_shm'], _worker[key] = _attach(name,shape,dtype)
+
+
+def _run(center_ind):
+    w = _worker
+    grid = w['grid']
+    shape = tuple(int(n) for n in grid[:,2])
+    eps,q,r,Dinv = w['consts']
+    return w['le']((center_ind,w['sim'],w['args'],grid,shape,eps,q,r,Dinv))
+
+
+class BoAExecutor(object):
+
+    # Persistent worker pool for BoA sweeps: sim/args are shipped once per
+    # worker, grid and p live in shared memory, centers go out in chunks
+    def __init__(self,le,sim,args,grid,p,consts,nodes=8,parallel=True,
+                 chunksize=None):
+        self.le = le
+        self.sim = sim
+        self.args = args
+        self.consts = consts
+        self.nodes = nodes
+        self.chunksize = chunksize
+        self.parallel = parallel and nodes > 1
+        self._shm = {}
+        self.pool = None
+
+        if self.parallel and shared_memory is not None:
+            self.grid = self._share('grid',grid)
+            self.p = self._share('p',p)
+            shared = dict((key,(shm.name,arr.shape,arr.dtype.str))
+                          for key,(shm,arr) in self._shm.items())
+            self.pool = Pool(processes=nodes,initializer=_init_worker,
+                             initargs=(le,sim,args,shared,consts))
+        else:
+            self.grid = np.array(grid)
+            self.p = np.array(p,dtype=float)
+            if self.parallel:
+                self.pool = Pool(processes=nodes)
+
+    def _share(self,key,a):
+        a = np.ascontiguousarray(a,dtype=float)
+        shm = shared_memory.SharedMemory(create=True,size=max(a.nbytes,1))
+        arr = np.ndarray(a.shape,dtype=a.dtype,buffer=shm.buf)
+        arr[...] = a
+        self._shm[key] = (shm,arr)
+        return arr
+
+    def chunks(self,n):
+        if self.chunksize is not None:
+            return self.chunksize
+        # ~4 chunks per worker balances load against dispatch overhead
+        return max(1,int(math.ceil(n/(4.*self.nodes))))
+
+    def map(self,center_inds):
+        center_inds = list(center_inds)
+        eps,q,r,Dinv = self.consts
+        shape = tuple(int(n) for n in self.grid[:,2])
+        if self.pool is None:
+            return [self.le((ind,self.sim,self.args,self.grid,shape,
+                             eps,q,r,Dinv)) for ind in center_inds]
+        chunksize = self.chunks(len(center_inds))
+        if self._shm:
+            return self.pool.map(_run,center_inds,chunksize)
+        x = [(ind,self.sim,self.args,self.grid,shape,eps,q,r,Dinv)
+             for ind in center_inds]
+        return self.pool.map(self.le,x,chunksize)
+
+    def close(self,terminate=False):
+        if self.pool is not None:
+            if terminate:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self._shm:
+            # detach results from the segments before releasing them
+            self.grid = np.array(self.grid)
+            self.p = np.array(self.p)
+            shms = [shm for shm,_ in self._shm.values()]
+            self._shm = {}
+            for shm in shms:
+                try:
+                    shm.close()
+                except BufferError:
+                    # caller still holds a view; mapping goes with it
+                    pass
+                shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc,tb):
+        # On an error, don't wait for workers still busy with other chunks
+        self.close(terminate=exc_type is not None)
+        return False
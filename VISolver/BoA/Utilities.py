@@ -57,17 +57,51 @@ def ind2int(ind,shape):
 
 # Determine cube of grid points surrounding point pt
 def pt2inds(pt,grid,checkBnds=False):
-    lo = np.array([int(i) for i in (pt-grid[:,0])//grid[:,3]])
-    rng = 2*np.ones(len(lo))
+    cube = pts2cubes(pt,grid)[0]
     if checkBnds:
-        bnds = []
-        for idx in np.ndindex(*rng):
-            vert = tuple(np.add(idx,lo))
-            if all(i >= 0 and i < grid[j,2] for j,i in enumerate(vert)):
-                bnds.append(vert)
-        return bnds
-    else:
-        return [tuple(np.add(idx,lo)) for idx in np.ndindex(*rng)]
+        cube = cube[np.all((cube >= 0) & (cube < grid[:,2]),axis=1)]
+    return [tuple(v) for v in cube]
+
+
+# Array versions of the above: ids are (N,), inds/pts are (N,d)
+def ints2inds(ids,shape):
+    return np.array(np.unravel_index(ids,shape)).T
+
+
+def inds2ints(inds,shape):
+    return np.ravel_multi_index(np.asarray(inds,dtype=int).T,shape)
+
+
+def inds2pts(inds,grid):
+    return grid[:,0] + np.asarray(inds)*grid[:,3]
+
+
+# Offsets of the 2^d vertices of a unit cube, ordered as in pt2inds
+def cube_offsets(d):
+    return np.array(list(np.ndindex(*(2,)*d)),dtype=int)
+
+
+# Vertices (N,2^d,d) of the grid cubes surrounding each of pts (N,d)
+def pts2cubes(pts,grid):
+    pts = np.atleast_2d(pts)
+    lo = np.floor((pts-grid[:,0])/grid[:,3]).astype(int)
+    return lo[:,None,:] + cube_offsets(grid.shape[0])
+
+
+# Cache of neighbor offsets within distance r, keyed by (grid, r)
+_stencils = {}
+
+
+def neighbor_stencil(grid,r):
+    key = (grid.tobytes(),grid.shape,r)
+    if key not in _stencils:
+        inc = grid[:,3]
+        i_max = np.array([int(v) for v in r//inc])
+        offsets = np.array(list(np.ndindex(*(i_max*2+1))),dtype=int) - i_max
+        keep = np.any(offsets != 0,axis=1)
+        keep &= np.linalg.norm(offsets*inc,axis=1) < r
+        _stencils[key] = offsets[keep]
+    return _stencils[key]
 
 
 # Determine all grid points within maximum distance, r, of grid index
@@ -77,22 +111,11 @@ def neighbors(ind,grid,r,q=None,Dinv=1):
     hi = grid[:,1]
     inc = grid[:,3]
 
-    # Initialize maximum possible neighbor grid
-    i_max = np.array([int(v) for v in r//inc])
-    cube = np.ndindex(*(i_max*2+1))
-
-    # Grow neighbor grid by scanning cube
-    neigh = []
-    for idx in cube:
-        offset = [v - i_max[k] for k,v in enumerate(idx)]
-        if any(v != 0 for k,v in enumerate(offset)):  # if not origin
-            # Convert index to cartesian
-            n = np.add(offset,ind)
-            loc = lo+n*inc
-            # Add grid index point if in grid range and within r of index
-            if all(loc >= lo) and all(loc <= hi) and \
-               np.linalg.norm(offset*inc) < r:
-                neigh += [tuple(n)]
+    # Shift precomputed stencil to index and keep points in grid range
+    n = np.add(neighbor_stencil(grid,r),ind)
+    loc = lo+n*inc
+    inbnds = np.all(np.logical_and(loc >= lo,loc <= hi),axis=1)
+    neigh = [tuple(v) for v in n[inbnds]]
 
     # Return all neighbors
     if q is None:
@@ -1,3 +1,9 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
 
 class Domain(object):
 
@@ -5,3 +11,74 @@ class Domain(object):
         raise NotImplementedError(
             'This is a generic domain object. '
             'You need to pick a specific domain to use.')
+
+    def CacheF(self,Size=4):
+        # Memoize F so gap/merit functions evaluated by Storage.BookKeeping
+        # reuse the F(x) the solver just computed. Call before constructing
+        # the Method - solvers bind Domain.F at init.
+        if not isinstance(self.F,CachedF):
+            self.F = CachedF(self.F,Size)
+        return self.F
+
+
+class CachedF(object):
+
+    # Small LRU of F evaluations keyed by a digest of the point's contents.
+    # Entries are read-only copies and hits hand out fresh copies, so a
+    # caller updating F in place cannot corrupt later hits. The lock guards
+    # the LRU against requests evaluated on a thread pool.
+    def __init__(self,F,Size=4):
+        self.F = F
+        self.Size = Size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.__name__ = getattr(F,'__name__','F')
+        self.__func__ = getattr(F,'__func__',F)
+
+    def key(self,Data):
+        Data = np.ascontiguousarray(Data)
+        digest = hashlib.blake2b(Data,digest_size=16)
+        return (Data.shape,Data.dtype.str,digest.digest())
+
+    def __call__(self,Data):
+        if not isinstance(Data,np.ndarray):
+            with self.lock:
+                self.misses += 1
+            return self.F(Data)
+        key = self.key(Data)
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key].copy()
+            self.misses += 1
+        F_Data = self.F(Data)
+        if isinstance(F_Data,np.ndarray):
+            Stored = F_Data.copy()
+            Stored.flags.writeable = False
+        else:
+            Stored = F_Data
+        with self.lock:
+            self.cache[key] = Stored
+            self.cache.move_to_end(key)
+            if len(self.cache) > self.Size:
+                self.cache.popitem(last=False)
+        return F_Data
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __getstate__(self):
+        # Locks cannot be pickled, e.g. when requests go to a process pool
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
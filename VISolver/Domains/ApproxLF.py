@@ -1,5 +1,3 @@
-from itertools import permutations
-
 import numpy as np
 
 from VISolver.Domain import Domain
@@ -9,7 +7,7 @@ from VISolver.Utilities import UnpackFlattened
 
 class ApproxLF(LinearField):
 
-  def __init__(self,X,dy,seqs=None,batch_size=10,eps=1e-4):
+  def __init__(self,X,dy,seqs=None,batch_size=10,eps=1e-4,pair_table=False):
     self.X = np.reshape(X,(X.shape[0],-1))
     self.XDim = X.shape[1]
     XDim = self.XDim
@@ -17,16 +15,8 @@ class ApproxLF(LinearField):
 
     self.dy = dy
     self.seqs = seqs
-    if seqs is None:
-      assert dy.shape == (X.shape[0],)
-      seqs = list(permutations(range(X.shape[0]),2))
-      dy = [dy[xf]-dy[x0] for x0,xf in seqs]
-    else:
-      assert dy.shape[0] == len(seqs)
-    seqdy = list(zip(seqs,dy))
-    np.random.shuffle(seqdy)
-    self.seqdy = seqdy
-    self.Nseqs = len(seqdy)
+    self.pair_table = pair_table
+    self.InitSeqs(X,dy,seqs,ordered=True,table=pair_table)
 
     self.batch_size = batch_size
 
@@ -39,12 +29,11 @@ class ApproxLF(LinearField):
     A,b = self.ExtractParams(params)
 
     # Retrieve data
-    idxs = np.random.choice(self.Nseqs,size=self.batch_size)
+    seqs,dys = self.SampleSeqs()
 
     grad = np.zeros_like(params)
 
-    for idx in idxs:
-      seq,dy = self.seqdy[idx]
+    for seq,dy in zip(seqs,dys):
       xi = [self.X[i] for i in seq]
 
       # Compute predictions and gradients
@@ -67,12 +56,11 @@ class ApproxLF(LinearField):
     A,b = self.ExtractParams(params)
 
     # Retrieve data
-    idxs = np.random.choice(self.Nseqs,size=self.batch_size)
+    seqs,dys = self.SampleSeqs()
 
     err = 0
 
-    for idx in idxs:
-      seq,dy = self.seqdy[idx]
+    for seq,dy in zip(seqs,dys):
       xi = [self.X[i] for i in seq]
 
       # Compute predictions
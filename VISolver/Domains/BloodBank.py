@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.sparse as sp
 
 import matplotlib as mpl
 mpl.use("Agg")
@@ -11,17 +12,22 @@ from VISolver.Domain import Domain
 
 class BloodBank(Domain):
 
-    def __init__(self,Network,alpha=2):
+    def __init__(self,Network,alpha=2,Fast=False):
         self.UnpackNetwork(Network)
         self.Network = (self.nC,self.nB,self.nD,self.nR)
         self.Dim = self.CalculateNetworkSize()
         self.alpha = alpha
+        self.Fast = Fast
+        if self.Fast:
+            self.CompileLayout()
 
         self.cmap = cm.Reds
         norm = mpl.colors.Normalize(vmin=0.,vmax=1.)
         self.to_rgba = [cm.ScalarMappable(norm=norm, cmap=self.cmap).to_rgba]*6
 
     def F(self,Data):
+        if self.Fast:
+            return self.F_P2UP_Fast(Data)
         return self.F_P2UP(Data)
 
     def gap_rplus(self, X):
@@ -189,6 +195,109 @@ class BloodBank(Domain):
 
         return xSize+uSize+gamSize
 
+    def CompileLayout(self):
+
+        # Links are ordered like the u (and gam) blocks of Data:
+        # 1C, CB, BP, PS, SD, DR
+        nC,nB,nD,nR = self.nC,self.nB,self.nD,self.nR
+        self.nX = nC*nB*nD*nR
+        sizes = [nC,nC*nB,nB,nB,nB*nD,nD*nR]
+        off = np.cumsum([0]+sizes)
+        self.nU = off[-1]
+
+        # Link of every path at each level, paths in flattened (c,b,d,r) order
+        c,b,d,r = [np.ravel(i) for i in np.indices((nC,nB,nD,nR))]
+        links = np.concatenate([off[0]+c,
+                                off[1]+c*nB+b,
+                                off[2]+b,
+                                off[3]+b,
+                                off[4]+b*nD+d,
+                                off[5]+d*nR+r])
+        paths = np.tile(np.arange(self.nX),6)
+        weights = np.concatenate([np.ones(self.nX),
+                                  self.alpha_CBf,self.alpha_BPf,
+                                  self.alpha_PSf,self.alpha_SDf,
+                                  self.alpha_DRf])
+
+        # Weighted (link flow) and plain (gam gather) path-link incidences
+        shape = (self.nU,self.nX)
+        self.A_LP = sp.csr_matrix((weights,(links,paths)),shape=shape)
+        self.A_LPT = self.A_LP.T.tocsr()
+        self.G_PL = sp.csr_matrix((np.ones(links.size),(paths,links)),
+                                  shape=shape[::-1])
+        self.M_RP = sp.csr_matrix((self.mu.ravel(),(r,np.arange(self.nX))),
+                                  shape=(nR,self.nX))
+        self.r_P = r
+
+        # Per-link cost coefficients stacked in the same order
+        def stack(*blocks):
+            return np.concatenate([np.ravel(blk) for blk in blocks])
+        self.chat1_L = stack(self.chat_pow1_1C,self.chat_pow1_CB,
+                             self.chat_pow1_BP,self.chat_pow1_PS,
+                             self.chat_pow1_SD,self.chat_pow1_DR)
+        self.chatzhat2_L = 2.*(stack(self.chat_pow2_1C,self.chat_pow2_CB,
+                                     self.chat_pow2_BP,self.chat_pow2_PS,
+                                     self.chat_pow2_SD,self.chat_pow2_DR) +
+                               stack(self.zhat_1C,self.zhat_CB,
+                                     self.zhat_BP,self.zhat_PS,
+                                     self.zhat_SD,self.zhat_DR))
+        self.chatzhat2_L[:nC] += 2.*self.theta*self.rhat
+        self.pihat1_L = stack(self.pihat_pow1_1C,self.pihat_pow1_CB,
+                              self.pihat_pow1_BP,self.pihat_pow1_PS,
+                              self.pihat_pow1_SD,self.pihat_pow1_DR)
+        self.pihat2_L = 2.*stack(self.pihat_pow2_1C,self.pihat_pow2_CB,
+                                 self.pihat_pow2_BP,self.pihat_pow2_PS,
+                                 self.pihat_pow2_SD,self.pihat_pow2_DR)
+        self.ubar_L = stack(self.ubar_1C,self.ubar_CB,self.ubar_BP,
+                            self.ubar_PS,self.ubar_SD,self.ubar_DR)
+        self.mu_P = self.mu.ravel()
+
+    def F_P2UP_Fast(self,Data,out=None):
+
+        # Same F as F_P2UP using the incidences from CompileLayout; pass out
+        # to reuse a preallocated result vector
+        if out is None:
+            out = np.empty(self.Dim)
+        nX, nU = self.nX, self.nU
+        x = Data[:nX]
+        u = Data[nX:nX+nU]
+        gam = Data[nX+nU:]
+
+        f = self.A_LP.dot(x)
+        nu = self.M_RP.dot(x)
+        Pknuk = (nu-self.prob_low)/(self.prob_high-self.prob_low)
+        shortage = self.lambda_plus*Pknuk - self.lambda_minus*(1-Pknuk)
+
+        out[:nX] = self.A_LPT.dot(self.chatzhat2_L*f+self.chat1_L) + \
+            self.mu_P*shortage[self.r_P] + self.G_PL.dot(gam)
+        out[nX:nX+nU] = self.pihat2_L*u + self.pihat1_L - gam
+        out[nX+nU:] = self.ubar_L + u - f
+
+        return out
+
+    def Jv(self,Data,Psi,F_Data=None):
+
+        # J(Data)*Psi from the incidences of CompileLayout without forming J
+        if not hasattr(self,'A_LP'):
+            self.CompileLayout()
+        nX, nU = self.nX, self.nU
+        Psi = Psi.reshape((Data.size,-1))
+        dx = Psi[:nX]
+        du = Psi[nX:nX+nU]
+        dgam = Psi[nX+nU:]
+
+        df = self.A_LP.dot(dx)
+        dshortage = ((self.lambda_plus+self.lambda_minus) /
+                     (self.prob_high-self.prob_low))[:,None]*self.M_RP.dot(dx)
+
+        res = np.empty_like(Psi)
+        res[:nX] = self.A_LPT.dot(self.chatzhat2_L[:,None]*df) + \
+            self.M_RP.T.dot(dshortage) + self.G_PL.dot(dgam)
+        res[nX:nX+nU] = self.pihat2_L[:,None]*du - dgam
+        res[nX+nU:] = du - df
+
+        return res
+
     def F_P2UP(self,Data):
 
         # Unpack Data
@@ -10,8 +10,8 @@ class Lienard(Domain):
         self.gap_alpha = gap_alpha
 
     def F(self,Data):
-        x,y = Data
-        dxy = np.array([y-.32*(x**5.)+4./3.*(x**3.)-.8*x,-x])
+        x,y = Data[...,0],Data[...,1]
+        dxy = np.stack([y-.32*(x**5.)+4./3.*(x**3.)-.8*x,-x],axis=-1)
         return dxy
 
     def Jac(self,Data):
@@ -1,6 +1,6 @@
 from itertools import product as crossprod
-from itertools import combinations
 import copy
+from math import factorial
 
 import numpy as np
 from scipy.linalg import svd
@@ -10,6 +10,16 @@ from VISolver.Domain import Domain
 from VISolver.Utilities import UnpackFlattened, GramSchmidt
 
 from IPython import embed
+
+
+def StackTerms(terms,dtype=None):
+  # Terms may mix scalars with (batch,) arrays when x0/xf are stacked
+  if all(np.ndim(term) == 0 for term in terms):
+    return np.asarray(terms,dtype=dtype)
+  terms = np.stack(np.broadcast_arrays(*terms))
+  return terms if dtype is None else terms.astype(dtype)
+
+
 class LFProj(Projection):
   def __init__(self,param_shapes):
     self.param_shapes = param_shapes
@@ -35,9 +45,43 @@ class LFProj(Projection):
     return np.hstack([P.flatten(),D.flatten(),b.flatten()])
 
 
+class PairSampler(object):
+
+  # Draws (x0,xf) index pairs over N points on demand rather than listing
+  # all O(N^2) of them: x0 < xf like combinations, or any x0 != xf like
+  # permutations if ordered. table=True instead enumerates every pair once
+  # into a shuffled int32 table and samples its rows.
+  def __init__(self,N,ordered=False,table=False):
+    assert N >= 2, 'Need at least two points to form a pair.'
+    self.N = N
+    self.ordered = ordered
+    self.Npairs = N*(N-1) if ordered else N*(N-1)//2
+    self.table = None
+    if table:
+      if ordered:
+        x0,xf = np.nonzero(~np.eye(N,dtype=bool))
+      else:
+        x0,xf = np.triu_indices(N,k=1)
+      pairs = np.stack([x0,xf],axis=1).astype(np.int32)
+      self.table = pairs[np.random.permutation(self.Npairs)]
+
+  def Sample(self,size):
+    if self.table is not None:
+      return self.table[np.random.randint(self.Npairs,size=size)]
+    # Rejection: redraw the (probability 1/N) draws with x0 == xf
+    pairs = np.random.randint(self.N,size=(size,2)).astype(np.int32)
+    same = pairs[:,0] == pairs[:,1]
+    while np.any(same):
+      pairs[same] = np.random.randint(self.N,size=(np.sum(same),2))
+      same = pairs[:,0] == pairs[:,1]
+    if not self.ordered:
+      pairs.sort(axis=1)
+    return pairs
+
+
 class LinearField(Domain):
 
-  def __init__(self,X,dy,seqs=None,batch_size=100,eps=1e-8):
+  def __init__(self,X,dy,seqs=None,batch_size=100,eps=1e-8,pair_table=False):
     self.X = np.reshape(X,(X.shape[0],-1))
     self.XDim = X.shape[1]
     XDim = self.XDim
@@ -45,72 +89,98 @@ class LinearField(Domain):
 
     self.dy = dy
     self.seqs = seqs
-    if seqs is None:
-      assert dy.shape == (X.shape[0],)
-      seqs = list(combinations(range(X.shape[0]),2))
-      dy = [dy[xf]-dy[x0] for x0,xf in seqs]
-    else:
-      assert dy.shape[0] == len(seqs)
-    seqdy = list(zip(seqs,dy))
-    np.random.shuffle(seqdy)
-    self.seqdy = seqdy
-    self.Nseqs = len(seqdy)
+    self.pair_table = pair_table
+    self.InitSeqs(X,dy,seqs,ordered=False,table=pair_table)
 
     self.batch_size = batch_size
 
     self.eps = eps
 
+  def InitSeqs(self,X,dy,seqs,ordered,table):
+    if seqs is None:
+      # Pairs of data points are drawn on demand, dy[xf]-dy[x0] per draw
+      assert dy.shape == (X.shape[0],)
+      self.sampler = PairSampler(X.shape[0],ordered=ordered,table=table)
+      self.seqidx = None
+      self.seqdy = None
+      self.Nseqs = self.sampler.Npairs
+    else:
+      # Sequences are kept as rows of an (Nseqs,L) array of indices into X,
+      # or as an object array of index arrays if their lengths differ
+      assert dy.shape[0] == len(seqs)
+      shuffle = np.random.permutation(len(seqs))
+      self.sampler = None
+      if len(set(len(seq) for seq in seqs)) <= 1:
+        seqidx = np.asarray(seqs,dtype=np.int32)
+      else:
+        seqidx = np.empty(len(seqs),dtype=object)
+        seqidx[:] = [np.asarray(seq,dtype=np.int32) for seq in seqs]
+      self.seqidx = seqidx[shuffle]
+      self.seqdy = np.asarray(dy,dtype=float)[shuffle]
+      self.Nseqs = len(shuffle)
+
+  def SampleSeqs(self):
+    # batch_size random sequences (rows of indices into X) and their dy
+    if self.sampler is not None:
+      seqs = self.sampler.Sample(self.batch_size)
+      return seqs, self.dy[seqs[:,1]]-self.dy[seqs[:,0]]
+    idxs = np.random.choice(self.Nseqs,size=self.batch_size)
+    return self.seqidx[idxs], self.seqdy[idxs]
+
+  def SampleBatch(self):
+    # Consecutive (x0,xf) pairs of batch_size random sequences, stacked;
+    # steps is the pair count per sequence, or each pair's sequence id if
+    # the sequences are ragged
+    seqs,dy = self.SampleSeqs()
+    if seqs.dtype != object:
+      x0 = self.X[seqs[:,:-1]].reshape(-1,self.XDim)
+      xf = self.X[seqs[:,1:]].reshape(-1,self.XDim)
+      return x0,xf,dy,seqs.shape[1]-1
+    x0 = self.X[np.concatenate([seq[:-1] for seq in seqs])]
+    xf = self.X[np.concatenate([seq[1:] for seq in seqs])]
+    lens = np.array([len(seq)-1 for seq in seqs])
+    return x0,xf,dy,np.repeat(np.arange(len(seqs)),lens)
+
+  def SumSeqs(self,vals,steps,Nseqs):
+    # Sum per-pair values along each sequence of a SampleBatch
+    if np.isscalar(steps):
+      return vals.reshape((Nseqs,steps)+vals.shape[1:]).sum(axis=1)
+    total = np.zeros((Nseqs,)+vals.shape[1:],dtype=vals.dtype)
+    np.add.at(total,steps,vals)
+    return total
+
   '''
   Compute gradient of field prediction with respect to field parameters
   '''
   def F(self,params):
     # Retrieve data
-    idxs = np.random.choice(self.Nseqs,size=self.batch_size)
-
-    grad = np.zeros_like(params)
-    # grad_check = np.zeros_like(params)
+    x0,xf,dy,steps = self.SampleBatch()
 
-    for idx in idxs:
-      seq,dy = self.seqdy[idx]
-      xi = [self.X[i] for i in seq]
+    # Decompose the field once for the whole minibatch
+    fields = self.ExtractParams(params)
 
-      # Compute predictions and gradients
-      dy_field = 0
-      dy_field_grad = np.zeros_like(params)
-      # dy_field_findiff = np.zeros_like(params)
-      for x0,xf in zip(xi[:-1],xi[1:]):
-        dy_field += self.predict(params,t0=0,x0=x0,y0=0,tf=1,xf=xf,t=1)
-        dy_field_grad += self.gradient(params,t0=0,x0=x0,y0=0,tf=1,xf=xf,t=1)
-        # dy_field_findiff += self.findiff(params,t0=0,x0=x0,y0=0,tf=1,xf=xf,t=1)
+    # Compute predictions and gradients, summed along each sequence
+    dy_field = self.predict(fields,t0=0,x0=x0,y0=0,tf=1,xf=xf,t=1)
+    dy_field = self.SumSeqs(dy_field,steps,len(dy))
+    dy_field_grad = self.gradient(fields,t0=0,x0=x0,y0=0,tf=1,xf=xf,t=1)
+    dy_field_grad = self.SumSeqs(dy_field_grad,steps,len(dy))
 
-      derr = self.derror(dy_field,dy)
+    derr = self.derror(dy_field,dy)
 
-      grad += derr*dy_field_grad/self.batch_size
-      # grad_check += derr*dy_field_findiff/self.batch_size
-
-    return grad
+    return derr.dot(dy_field_grad)/self.batch_size
 
   '''
   Compute error of field prediction
   '''
   def error(self,params):
     # Retrieve data
-    idxs = np.random.choice(self.Nseqs,size=self.batch_size)
+    x0,xf,dy,steps = self.SampleBatch()
 
-    err = 0
+    # Compute predictions
+    dy_field = self.predict(self.ExtractParams(params),t0=0,x0=x0,y0=0,tf=1,xf=xf,t=1)
+    dy_field = self.SumSeqs(dy_field,steps,len(dy))
 
-    for idx in idxs:
-      seq,dy = self.seqdy[idx]
-      xi = [self.X[i] for i in seq]
-
-      # Compute predictions
-      dy_field = 0
-      for x0,xf in zip(xi[:-1],xi[1:]):
-        dy_field += self.predict(params,t0=0,x0=x0,y0=0,tf=1,xf=xf,t=1)
-
-      err += 0.5*(dy_field-dy)**2/self.batch_size
-
-    return err
+    return np.sum(0.5*(dy_field-dy)**2)/self.batch_size
 
   '''
   Compute derivative of error
@@ -137,12 +207,16 @@ class LinearField(Domain):
 
   def AuxParams(self,x0,xf,A,Pinv,D,P,b):
     sqrtD = np.sqrt(D)
-    Px0 = P.dot(x0)
-    Pxf = P.dot(xf)
+    Px0 = x0.dot(P.T)
+    Pxf = xf.dot(P.T)
     d = self.d(P,b)
     return sqrtD,Px0,Pxf,d
 
   def ExtractParams(self,params):
+    # Already extracted (A,Pinv,D,P,b) pass straight through so callers can
+    # decompose once and reuse it across a minibatch
+    if isinstance(params,tuple) and len(params) == 5:
+      return params
     if len(params) == 2:
       return self.DecomposeField(*params)
     else:
@@ -195,7 +269,7 @@ class LinearField(Domain):
     fdD = np.zeros_like(D)
     for u in crossprod(range(self.XDim)):
       Dtemp = copy.copy(D)
-      Dtemp[u] += eps*(1+1j)
+      Dtemp[u] += eps
       sqrtDtemp = np.sqrt(Dtemp)
       Atemp = self.A(Pinv,P,Dtemp)
       dtemp = self.d(P,b)
@@ -227,33 +301,30 @@ class LinearField(Domain):
 
     dt = t - t0
     dt0f = tf - t0
-    zt = self.z(dt,dt0f,d,D,sqrtD,Px0,Pxf)
-    xt = self.ztox(Pinv,zt)
-
-    dP = np.zeros((self.XDim,self.XDim),dtype=np.complex)
-    dD = np.zeros(self.XDim,dtype=np.complex)
-    db = np.cast[np.complex](xf-x0)
 
-    int_dints = self.int_dint_zzdot(A,Pinv,P,D,b,dt,dt0f,zt,xt,x0,xf,sqrtD,Px0,Pxf,d)
+    int_dints = self.int_dint_zzdot(P,D,b,dt,dt0f,x0,xf,Px0,Pxf,d)
     int_zzdot, dint_zzdot_db, dint_zzdot_dD, dint_zzdot_dP = int_dints
 
-    for u,i,j,k,l in crossprod(*([range(self.XDim)]*5)):
-        db[u] += A[i,j]*Pinv[j,k]*Pinv[i,l]*dint_zzdot_db[u,k,l]
-        dD[u] += self.dAij_dDu(i,j,u,Pinv,P)*Pinv[j,k]*Pinv[i,l]*int_zzdot[k,l] + \
-          A[i,j]*Pinv[j,k]*Pinv[i,l]*dint_zzdot_dD[u,k,l]
+    # Chain rule through A and Pinv as tensor contractions over i,j,k,l
+    dA_dP = self.dA_dP(Pinv,P,D)
+    dA_dD = self.dA_dD(Pinv,P)
+    W = np.einsum('jk,il,...kl->...ij',Pinv,Pinv,int_zzdot,optimize=True)
+    B = np.einsum('ij,jk,il->kl',A,Pinv,Pinv)
 
-    for u,v,i,j,k,l in crossprod(*([range(self.XDim)]*6)):
-        dP[u,v] += self.dAij_dPuv(i,j,u,v,Pinv,P,D)*Pinv[j,k]*Pinv[i,l]*int_zzdot[k,l] - \
-          A[i,j]*Pinv[j,u]*Pinv[v,k]*Pinv[i,l]*int_zzdot[k,l] - \
-          A[i,j]*Pinv[j,k]*Pinv[i,u]*Pinv[v,l]*int_zzdot[k,l] + \
-          A[i,j]*Pinv[j,k]*Pinv[i,l]*dint_zzdot_dP[u,v,k,l]
+    db = (xf-x0).astype(complex) + np.einsum('kl,...ukl->...u',B,dint_zzdot_db)
+    dD = np.einsum('uij,...ij->...u',dA_dD,W) + \
+      np.einsum('kl,...ukl->...u',B,dint_zzdot_dD)
+    dP = np.einsum('uvij,...ij->...uv',dA_dP,W) - \
+      np.einsum('ij,ju,vk,il,...kl->...uv',A,Pinv,Pinv,Pinv,int_zzdot,optimize=True) - \
+      np.einsum('ij,jk,iu,vl,...kl->...uv',A,Pinv,Pinv,Pinv,int_zzdot,optimize=True) + \
+      np.einsum('kl,...uvkl->...uv',B,dint_zzdot_dP)
 
     # Enforce constraints on gradients (db is real, dD conjugate pair symmetry)
     # Unitary constraint on P will be enforced with Gram Schmidt "projection"
     db = np.real(db)
     dD = self.AverageConjugatePairs(D,dD)
 
-    dField = np.hstack([dP.flatten(),dD.flatten(),db.flatten()])
+    dField = np.concatenate([dP.reshape(dP.shape[:-2]+(-1,)),dD,db],axis=-1)
 
     return dField
 
@@ -261,9 +332,9 @@ class LinearField(Domain):
     i = 0
     while i < D.shape[0] - 1:
       Dconj = np.conj(D[i+1])
-      if np.allclose(D[i],Dconj):
-        dD[i] = (dD[i]+Dconj)/2
-        dD[i+1] = np.conj(dD[i])
+      if np.abs(np.imag(D[i])) > self.eps and np.allclose(D[i],Dconj):
+        dD[...,i] = (dD[...,i]+np.conj(dD[...,i+1]))/2
+        dD[...,i+1] = np.conj(dD[...,i])
         i += 2
       else:
         i += 1
@@ -289,8 +360,8 @@ class LinearField(Domain):
 
     for i,k,l in crossprod(*([range(self.XDim)]*3)):
 
-      Px0k, Px0l = Px0[k], Px0[l]
-      Pxfk, Pxfl = Pxf[k], Pxf[l]
+      Px0k, Px0l = Px0[...,k], Px0[...,l]
+      Pxfk, Pxfl = Pxf[...,k], Pxf[...,l]
       dk, dl = d[k], d[l]
       Dk, Dl = D[k], D[l]
       sqrtDk, sqrtDl = np.sqrt(Dk), np.sqrt(Dl)
@@ -325,8 +396,8 @@ class LinearField(Domain):
 
     for i,j,k,l in crossprod(*([range(self.XDim)]*4)):
 
-      Px0k, Px0l = Px0[k], Px0[l]
-      Pxfk, Pxfl = Pxf[k], Pxf[l]
+      Px0k, Px0l = Px0[...,k], Px0[...,l]
+      Pxfk, Pxfl = Pxf[...,k], Pxf[...,l]
       dk, dl = d[k], d[l]
       Dk, Dl = D[k], D[l]
       sqrtDk, sqrtDl = np.sqrt(Dk), np.sqrt(Dl)
@@ -400,10 +471,10 @@ class LinearField(Domain):
     zt = self.z(dt,dt0f,d,D,sqrtD,Px0,Pxf)
     xt = self.ztox(Pinv,zt)
 
-    int_zzdot = np.zeros((self.XDim,self.XDim),dtype=np.complex)
+    int_zzdot = np.zeros(Px0.shape[:-1]+(self.XDim,)*2,dtype=complex)
     for k,l in crossprod(*([range(self.XDim)]*2)):
-      Px0k, Px0l = Px0[k], Px0[l]
-      Pxfk, Pxfl = Pxf[k], Pxf[l]
+      Px0k, Px0l = Px0[...,k], Px0[...,l]
+      Pxfk, Pxfl = Pxf[...,k], Pxf[...,l]
       dk, dl = d[k], d[l]
       Dk, Dl = D[k], D[l]
       sqrtDk, sqrtDl = np.sqrt(Dk), np.sqrt(Dl)
@@ -428,17 +499,16 @@ class LinearField(Domain):
         c2l = self.c2i_n0(dt0f,Px0l,Pxfl,Dl,sqrtDl,dl)
 
       if kc and lc:
-        int_zzdot[k,l] = self.int_z0_z0dot(dt,dk,dl,c1k,c1l,c2k,c2l)
+        int_zzdot[...,k,l] = self.int_z0_z0dot(dt,dk,dl,c1k,c1l,c2k,c2l)
       elif kc and not lc:
-        int_zzdot[k,l] = self.int_z0_zn0dot(dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l)
+        int_zzdot[...,k,l] = self.int_z0_zn0dot(dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l)
       elif not kc and lc:
-        int_zzdot[k,l] = self.int_zn0_z0dot(dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k,c2l)
+        int_zzdot[...,k,l] = self.int_zn0_z0dot(dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k,c2l)
       elif not kc and not lc:
-        int_zzdot[k,l] = self.int_zn0_zn0dot(dt,dk,dl,Dk,Dl,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l)
+        int_zzdot[...,k,l] = self.int_zn0_zn0dot(dt,dk,dl,Dk,Dl,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l)
 
-    path_int = np.dot(b,xt-x0)
-    for i,j,k,l in crossprod(*([range(self.XDim)]*4)):
-      path_int += A[i,j]*Pinv[j,k]*Pinv[i,l]*int_zzdot[k,l]
+    path_int = (xt-x0).dot(b) + \
+      np.einsum('ij,jk,il,...kl->...',A,Pinv,Pinv,int_zzdot,optimize=True)
 
     # if np.imag(path_int) > self.eps:
     #   raise ValueError('Imaginary part of path integral is suspicially large. Should always be zero.\n%g'%np.imag(path_int))
@@ -466,13 +536,13 @@ class LinearField(Domain):
     return np.sum(Pinv_kl*zzdot)
 
   def ztox(self,Pinv,z):
-    return Pinv.dot(z)
+    return z.dot(Pinv.T)
 
   def z(self,dt,dt0f,d,D,sqrtD,Px0,Pxf):
     zis = []
     for i in range(self.XDim):
-      Px0i = Px0[i]
-      Pxfi = Pxf[i]
+      Px0i = Px0[...,i]
+      Pxfi = Pxf[...,i]
       Di = D[i]
       sqrtDi = sqrtD[i]
       di = d[i]
@@ -485,13 +555,13 @@ class LinearField(Domain):
         c2i = self.c2i_n0(dt0f,Px0i,Pxfi,Di,sqrtDi,di)
         zi = self.zi_n0(dt,di,Di,sqrtDi,c1i,c2i)
       zis += [zi]
-    return np.asarray(zis)
+    return np.stack(np.broadcast_arrays(*zis),axis=-1)
 
   def zdot(self,dt,dt0f,d,D,sqrtD,Px0,Pxf):
     zidots = []
     for i in range(self.XDim):
-      Px0i = Px0[i]
-      Pxfi = Pxf[i]
+      Px0i = Px0[...,i]
+      Pxfi = Pxf[...,i]
       Di = D[i]
       sqrtDi = sqrtD[i]
       di = d[i]
@@ -508,8 +578,8 @@ class LinearField(Domain):
   def zddot(self,dt,dt0f,d,D,sqrtD,Px0,Pxf):
     ziddots = []
     for i in range(self.XDim):
-      Px0i = Px0[i]
-      Pxfi = Pxf[i]
+      Px0i = Px0[...,i]
+      Pxfi = Pxf[...,i]
       Di = D[i]
       sqrtDi = sqrtD[i]
       di = d[i]
@@ -578,7 +648,7 @@ class LinearField(Domain):
     zzdot_kl_5 = -c2k*dl*dt
     zzdot_kl_6 = c2k*c1l
 
-    return np.asarray([zzdot_kl_1,zzdot_kl_2,zzdot_kl_3,
+    return StackTerms([zzdot_kl_1,zzdot_kl_2,zzdot_kl_3,
                        zzdot_kl_4,zzdot_kl_5,zzdot_kl_6])
 
   def z0_zn0dot(self,dt,dk,sqrtDl,c1k,c1l,c2k,c2l):
@@ -596,7 +666,7 @@ class LinearField(Domain):
     zzdot_kl_5 = c2k*c1l*sqrtDl*np.exp(sqrtDlt)
     zzdot_kl_6 = -c2k*c2l*sqrtDl*np.exp(-sqrtDlt)
 
-    return np.asarray([zzdot_kl_1,zzdot_kl_2,zzdot_kl_3,
+    return StackTerms([zzdot_kl_1,zzdot_kl_2,zzdot_kl_3,
                        zzdot_kl_4,zzdot_kl_5,zzdot_kl_6])
 
   def zn0_z0dot(self,dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k):
@@ -614,7 +684,7 @@ class LinearField(Domain):
     zzdot_kl_5 = -c2k*dl*dt*np.exp(-sqrtDkt)
     zzdot_kl_6 = c2k*c2l*np.exp(-sqrtDkt)
 
-    return np.asarray([zzdot_kl_1,zzdot_kl_2,zzdot_kl_3,
+    return StackTerms([zzdot_kl_1,zzdot_kl_2,zzdot_kl_3,
                        zzdot_kl_4,zzdot_kl_5,zzdot_kl_6])
 
   def zn0_zn0dot(self,dt,dk,Dk,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l):
@@ -635,13 +705,13 @@ class LinearField(Domain):
     zzdot_kl_5 = c2k*c1l*sqrtDl*np.exp(-sqrtDkt+sqrtDlt)
     zzdot_kl_6 = -c2k*c2l*sqrtDl*np.exp(-sqrtDkt-sqrtDlt)
 
-    return np.asarray([zzdot_kl_1,zzdot_kl_2,zzdot_kl_3,
+    return StackTerms([zzdot_kl_1,zzdot_kl_2,zzdot_kl_3,
                        zzdot_kl_4,zzdot_kl_5,zzdot_kl_6])
 
   ###### Z-ZDOT INTEGRALS
 
   def int_z0_z0dot(self,dt,dk,dl,c1k,c1l,c2k,c2l):
-    return np.sum(self.int_z0_z0dot_p(dt,dk,dl,c1k,c1l,c2k,c2l))
+    return np.sum(self.int_z0_z0dot_p(dt,dk,dl,c1k,c1l,c2k,c2l),axis=0)
 
   def int_z0_z0dot_p(self,dt,dk,dl,c1k,c1l,c2k,c2l):
 
@@ -652,11 +722,11 @@ class LinearField(Domain):
     intzzdot_kl_5 = -c2k*dl/2*dt**2
     intzzdot_kl_6 = c2k*c1l*dt
 
-    return np.asarray([intzzdot_kl_1,intzzdot_kl_2,intzzdot_kl_3,
+    return StackTerms([intzzdot_kl_1,intzzdot_kl_2,intzzdot_kl_3,
                        intzzdot_kl_4,intzzdot_kl_5,intzzdot_kl_6])
 
   def int_z0_zn0dot(self,dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l):
-    return np.sum(self.int_z0_zn0dot_p(dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l))
+    return np.sum(self.int_z0_zn0dot_p(dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l),axis=0)
 
   def int_z0_zn0dot_p(self,dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l):
     sqrtDlt = sqrtDl*dt
@@ -668,11 +738,11 @@ class LinearField(Domain):
     intzzdot_kl_5 = c2k*c1l*(np.exp(sqrtDlt)-1)
     intzzdot_kl_6 = c2k*c2l*(np.exp(-sqrtDlt)-1)
 
-    return np.asarray([intzzdot_kl_1,intzzdot_kl_2,intzzdot_kl_3,
+    return StackTerms([intzzdot_kl_1,intzzdot_kl_2,intzzdot_kl_3,
                        intzzdot_kl_4,intzzdot_kl_5,intzzdot_kl_6])
 
   def int_zn0_z0dot(self,dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k,c2l):
-    return np.sum(self.int_zn0_z0dot_p(dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k,c2l))
+    return np.sum(self.int_zn0_z0dot_p(dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k,c2l),axis=0)
 
   def int_zn0_z0dot_p(self,dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k,c2l):
     sqrtDkt = sqrtDk*dt
@@ -684,11 +754,11 @@ class LinearField(Domain):
     intzzdot_kl_5 = -c2k*dl/Dk*(np.exp(-sqrtDkt)*(-sqrtDkt-1)+1)
     intzzdot_kl_6 = -c2k*c1l/sqrtDk*(np.exp(-sqrtDkt)-1)
 
-    return np.asarray([intzzdot_kl_1,intzzdot_kl_2,intzzdot_kl_3,
+    return StackTerms([intzzdot_kl_1,intzzdot_kl_2,intzzdot_kl_3,
                        intzzdot_kl_4,intzzdot_kl_5,intzzdot_kl_6])
 
   def int_zn0_zn0dot(self,dt,dk,dl,Dk,Dl,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l):
-    return np.sum(self.int_zn0_zn0dot_p(dt,dk,dl,Dk,Dl,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l))
+    return np.sum(self.int_zn0_zn0dot_p(dt,dk,dl,Dk,Dl,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l),axis=0)
 
   def int_zn0_zn0dot_p(self,dt,dk,dl,Dk,Dl,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l):
     sqrtDkt = sqrtDk*dt
@@ -705,8 +775,8 @@ class LinearField(Domain):
       intzzdot_kl_5 = -c2k*c1l*sqrtDl/(sqrtDk-sqrtDl)*(np.exp(-sqrtDkt+sqrtDlt)-1)
     intzzdot_kl_6 = c2k*c2l*sqrtDl/(sqrtDk+sqrtDl)*(np.exp(-sqrtDkt-sqrtDlt)-1)
 
-    return np.asarray([intzzdot_kl_1,intzzdot_kl_2,intzzdot_kl_3,
-                       intzzdot_kl_4,intzzdot_kl_5,intzzdot_kl_6],dtype=np.complex)
+    return StackTerms([intzzdot_kl_1,intzzdot_kl_2,intzzdot_kl_3,
+                       intzzdot_kl_4,intzzdot_kl_5,intzzdot_kl_6],dtype=complex)
 
   ###### ZDOT-ZDOT PRODUCTS
 
@@ -722,7 +792,7 @@ class LinearField(Domain):
     zdotzdot_kl_3 = -c1k*dl*dt
     zdotzdot_kl_4 = c1k*c1l
 
-    return np.asarray([zdotzdot_kl_1,zdotzdot_kl_2,zdotzdot_kl_3,zdotzdot_kl_4])
+    return StackTerms([zdotzdot_kl_1,zdotzdot_kl_2,zdotzdot_kl_3,zdotzdot_kl_4])
 
   def z0dot_zn0dot(self,dt,dk,sqrtDl,c1k,c1l,c2l):
     zkdot = self.zidot_0(dt,dk,c1k)
@@ -737,7 +807,7 @@ class LinearField(Domain):
     zdotzdot_kl_3 = c1l*c1k*sqrtDl*np.exp(sqrtDlt)
     zdotzdot_kl_4 = -c2l*c1k*sqrtDl*np.exp(-sqrtDlt)
 
-    return np.asarray([zdotzdot_kl_1,zdotzdot_kl_2,zdotzdot_kl_3,zdotzdot_kl_4])
+    return StackTerms([zdotzdot_kl_1,zdotzdot_kl_2,zdotzdot_kl_3,zdotzdot_kl_4])
 
   def zn0dot_z0dot(self,dt,dl,sqrtDk,c1l,c1k,c2k):
     zkdot = self.zidot_n0(dt,sqrtDk,c1k,c2k)
@@ -752,7 +822,7 @@ class LinearField(Domain):
     zdotzdot_kl_3 = c1k*c1l*sqrtDk*np.exp(sqrtDkt)
     zdotzdot_kl_4 = -c2k*c1l*sqrtDk*np.exp(-sqrtDkt)
 
-    return np.asarray([zdotzdot_kl_1,zdotzdot_kl_2,zdotzdot_kl_3,zdotzdot_kl_4])
+    return StackTerms([zdotzdot_kl_1,zdotzdot_kl_2,zdotzdot_kl_3,zdotzdot_kl_4])
 
   def zn0dot_zn0dot(self,dt,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l):
     zkdot = self.zidot_n0(dt,sqrtDk,c1k,c2k)
@@ -769,12 +839,12 @@ class LinearField(Domain):
     zdotzdot_kl_3 = -c2k*c1l*sqrtDkl*np.exp(-sqrtDkt+sqrtDlt)
     zdotzdot_kl_4 = c2k*c2l*sqrtDkl*np.exp(-sqrtDkt-sqrtDlt)
 
-    return np.asarray([zdotzdot_kl_1,zdotzdot_kl_2,zdotzdot_kl_3,zdotzdot_kl_4])
+    return StackTerms([zdotzdot_kl_1,zdotzdot_kl_2,zdotzdot_kl_3,zdotzdot_kl_4])
 
   ###### ZDOT-ZDOT INTEGRALS
 
   def int_z0dot_z0dot(self,dt,dk,dl,c1k,c1l):
-    return np.sum(self.int_z0dot_z0dot_p(dt,dk,dl,c1k,c1l))
+    return np.sum(self.int_z0dot_z0dot_p(dt,dk,dl,c1k,c1l),axis=0)
 
   def int_z0dot_z0dot_p(self,dt,dk,dl,c1k,c1l):
 
@@ -783,11 +853,11 @@ class LinearField(Domain):
     intzdotzdot_kl_3 = -c1k*dl/2*dt**2
     intzdotzdot_kl_4 = c1k*c1l*dt
 
-    return np.asarray([intzdotzdot_kl_1,intzdotzdot_kl_2,
+    return StackTerms([intzdotzdot_kl_1,intzdotzdot_kl_2,
                        intzdotzdot_kl_3,intzdotzdot_kl_4])
 
   def int_z0dot_zn0dot(self,dt,dk,sqrtDl,c1l,c1k,c2l):
-    return np.sum(self.int_z0dot_zn0dot_p(dt,dk,sqrtDl,c1l,c1k,c2l))
+    return np.sum(self.int_z0dot_zn0dot_p(dt,dk,sqrtDl,c1l,c1k,c2l),axis=0)
 
   def int_z0dot_zn0dot_p(self,dt,dk,sqrtDl,c1l,c1k,c2l):
     sqrtDlt = sqrtDl*dt
@@ -797,11 +867,11 @@ class LinearField(Domain):
     intzdotzdot_kl_3 = c1l*c1k*np.exp(sqrtDlt)
     intzdotzdot_kl_4 = c2l*c1k*np.exp(-sqrtDlt)
 
-    return np.asarray([intzdotzdot_kl_1,intzdotzdot_kl_2,
+    return StackTerms([intzdotzdot_kl_1,intzdotzdot_kl_2,
                        intzdotzdot_kl_3,intzdotzdot_kl_4])
 
   def int_zn0dot_z0dot(self,dt,dl,sqrtDk,c1k,c1l,c2k):
-    return np.sum(self.int_zn0dot_z0dot_p(dt,dl,sqrtDk,c1k,c1l,c2k))
+    return np.sum(self.int_zn0dot_z0dot_p(dt,dl,sqrtDk,c1k,c1l,c2k),axis=0)
 
   def int_zn0dot_z0dot_p(self,dt,dl,sqrtDk,c1k,c1l,c2k):
     sqrtDkt = sqrtDk*dt
@@ -811,11 +881,11 @@ class LinearField(Domain):
     intzdotzdot_kl_3 = c1k*c1l*np.exp(sqrtDkt)
     intzdotzdot_kl_4 = c2k*c1l*np.exp(-sqrtDkt)
 
-    return np.asarray([intzdotzdot_kl_1,intzdotzdot_kl_2,
+    return StackTerms([intzdotzdot_kl_1,intzdotzdot_kl_2,
                        intzdotzdot_kl_3,intzdotzdot_kl_4])
 
   def int_zn0dot_zn0dot(self,dt,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l):
-    return np.sum(self.int_zn0dot_zn0dot_p(dt,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l))
+    return np.sum(self.int_zn0dot_zn0dot_p(dt,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l),axis=0)
 
   def int_zn0dot_zn0dot_p(self,dt,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l):
     sqrtDkt = sqrtDk*dt
@@ -831,13 +901,13 @@ class LinearField(Domain):
       intzdotzdot_kl_3 = -c2k*c1l*sqrtDkl/(sqrtDl-sqrtDk)*(np.exp(-sqrtDkt+sqrtDlt)-1)
     intzdotzdot_kl_4 = -c2k*c2l*sqrtDkl/(sqrtDk+sqrtDl)*(np.exp(-sqrtDkt-sqrtDlt)-1)
 
-    return np.asarray([intzdotzdot_kl_1,intzdotzdot_kl_2,
+    return StackTerms([intzdotzdot_kl_1,intzdotzdot_kl_2,
                        intzdotzdot_kl_3,intzdotzdot_kl_4])
 
   ###### Z-ZDOT DOUBLE INTEGRALS
 
   def intint_z0_z0dot(self,dt,dk,dl,c1k,c1l,c2k,c2l):
-    return np.sum(self.intint_z0_z0dot_p(dt,dk,dl,c1k,c1l,c2k,c2l))
+    return np.sum(self.intint_z0_z0dot_p(dt,dk,dl,c1k,c1l,c2k,c2l),axis=0)
 
   def intint_z0_z0dot_p(self,dt,dk,dl,c1k,c1l,c2k,c2l):
 
@@ -848,11 +918,11 @@ class LinearField(Domain):
     intintzzdot_kl_5 = -c2k*dl/6*dt**3
     intintzzdot_kl_6 = c2k*c1l/2*dt**2
 
-    return np.asarray([intintzzdot_kl_1,intintzzdot_kl_2,intintzzdot_kl_3,
+    return StackTerms([intintzzdot_kl_1,intintzzdot_kl_2,intintzzdot_kl_3,
                        intintzzdot_kl_4,intintzzdot_kl_5,intintzzdot_kl_6])
 
   def intint_z0_zn0dot(self,dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l):
-    return np.sum(self.intint_z0_zn0dot_p(dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l))
+    return np.sum(self.intint_z0_zn0dot_p(dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l),axis=0)
 
   def intint_z0_zn0dot_p(self,dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l):
     sqrtDlt = sqrtDl*dt
@@ -864,11 +934,11 @@ class LinearField(Domain):
     intintzzdot_kl_5 = c2k*c1l*(1/sqrtDl*np.exp(sqrtDlt)-dt)
     intintzzdot_kl_6 = c2k*c2l*(-1/sqrtDl*np.exp(-sqrtDlt)-dt)
 
-    return np.asarray([intintzzdot_kl_1,intintzzdot_kl_2,intintzzdot_kl_3,
+    return StackTerms([intintzzdot_kl_1,intintzzdot_kl_2,intintzzdot_kl_3,
                        intintzzdot_kl_4,intintzzdot_kl_5,intintzzdot_kl_6])
 
   def intint_zn0_z0dot(self,dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k):
-    return np.sum(self.intint_zn0_z0dot_p(dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k))
+    return np.sum(self.intint_zn0_z0dot_p(dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k),axis=0)
 
   def intint_zn0_z0dot_p(self,dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k):
     sqrtDkt = sqrtDk*dt
@@ -880,11 +950,11 @@ class LinearField(Domain):
     intintzzdot_kl_5 = -c2k*dl/Dk*(-1/sqrtDk*(np.exp(-sqrtDkt)*(-sqrtDkt-2)+2)+dt)
     intintzzdot_kl_6 = -c2k*c1l/sqrtDk*(-1/sqrtDk*(np.exp(-sqrtDkt)-1)-dt)
 
-    return np.asarray([intintzzdot_kl_1,intintzzdot_kl_2,intintzzdot_kl_3,
+    return StackTerms([intintzzdot_kl_1,intintzzdot_kl_2,intintzzdot_kl_3,
                        intintzzdot_kl_4,intintzzdot_kl_5,intintzzdot_kl_6])
 
   def intint_zn0_zn0dot(self,dt,dk,Dk,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l):
-    return np.sum(self.intint_zn0_zn0dot_p(dt,dk,Dk,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l))
+    return np.sum(self.intint_zn0_zn0dot_p(dt,dk,Dk,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l),axis=0)
 
   def intint_zn0_zn0dot_p(self,dt,dk,Dk,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l):
     sqrtDkt = sqrtDk*dt
@@ -901,434 +971,109 @@ class LinearField(Domain):
       intintzzdot_kl_5 = c2k*c1l*sqrtDl/(-sqrtDk+sqrtDl)*(1/(-sqrtDk+sqrtDl)*(np.exp(-sqrtDkt+sqrtDlt)-1)-dt)
     intintzzdot_kl_6 = c2k*c2l*sqrtDl/(sqrtDk+sqrtDl)*(1/(-sqrtDk-sqrtDl)*(np.exp(-sqrtDkt-sqrtDlt)-1)-dt)
 
-    return np.asarray([intintzzdot_kl_1,intintzzdot_kl_2,intintzzdot_kl_3,
+    return StackTerms([intintzzdot_kl_1,intintzzdot_kl_2,intintzzdot_kl_3,
                        intintzzdot_kl_4,intintzzdot_kl_5,intintzzdot_kl_6])
 
   ###### DERIVATIVES (ANY Dii)
 
   def dAij_dPuv(self,i,j,u,v,Pinv,P,D):
-    return -Pinv[i,u]*(D[u]*(v==j) + np.sum(Pinv[v,:]*D*P[:,j]))
+    return -Pinv[i,u]*(D[u]*(v==j) - np.sum(Pinv[v,:]*D*P[:,j]))
 
   def dAij_dDu(self,i,j,u,Pinv,P):
     return -Pinv[i,u]*P[u,j]
 
-  def ddi_dbu(self,i,u,P):
-    return P[i,u]
-
-  def ddi_dPuv(self,i,u,v,b):
-    return (u==i)*b[v]
-
-  def ddi_dDu(self,i,u,P,Pinv,x0):
-    return 0.
-
-  ###### PATH DERIVATIVES (|Dii| < eps)
-
-  def dc01i_dbu(self,i,u,dt0f,P):
-    return dt0f/2*self.ddi_dbu(i,u,P)
-
-  def dc02i_dbu(self,i,u):
-    return 0
-
-  def dc01i_dPuv(self,i,u,v,dt0f,xf,x0,A,b,Pinv,P,D):
-    return (i==u)*(xf[v]-x0[v])/dt0f + dt0f/2*self.ddi_dPuv(i,u,v,b)
-
-  def dc02i_dPuv(self,i,u,v,x0):
-    return (i==u)*x0[v]
-
-  def dc01i_dDu(self,i,u,dt0f,P,Pinv,x0):
-    return dt0f/2*self.ddi_dDu(i,u,P,Pinv,x0)
-
-  def dc02i_dDu(self,i,u):
-    return 0
-
-  ###### PATH DERIVATIVES (|Dii| >= eps)
-
-  def dcn01i_dbu(self,i,u,dt0f,P,D):
-    return -1/D[i]*self.ddi_dbu(i,u,P) - self.dcn02i_dbu(i,u,dt0f,P,D)
-
-  def dcn02i_dbu(self,i,u,dt0f,P,D):
-    sqrtDit = np.sqrt(D[i])*dt0f
-    return (np.exp(sqrtDit)-1)/(D[i]*(np.exp(-sqrtDit)-np.exp(sqrtDit)))*self.ddi_dbu(i,u,P)
-
-  def dcn01i_dPuv(self,i,u,v,dt0f,x0,xf,A,b,Pinv,P,D):
-    return (i==u)*x0[v] - 1/D[i]*self.ddi_dPuv(i,u,v,b) - self.dcn02i_dPuv(i,u,v,dt0f,x0,xf,A,b,Pinv,P,D)
-
-  def dcn02i_dPuv(self,i,u,v,dt0f,x0,xf,A,b,Pinv,P,D):
-    sqrtDit = np.sqrt(D[i])*dt0f
-    numer1 = (i==u)*(xf[v]-np.exp(sqrtDit)*x0[v])
-    numer2 = 1/D[i]*(np.exp(sqrtDit)-1)*self.ddi_dPuv(i,u,v,b)
-    denom = np.exp(-sqrtDit)-np.exp(sqrtDit)
-    return (numer1+numer2)/denom
-
-  def dcn01i_dDu(self,i,u,dt0f,x0,xf,A,b,Pinv,P,D,d):
-    return -1/D[i]*self.ddi_dDu(i,u,P,Pinv,x0) + (i==u)*d[i]/D[i]**2 - self.dcn02i_dDu(i,u,dt0f,x0,xf,A,b,Pinv,P,D,d)
-
-  def dcn02i_dDu(self,i,u,dt0f,x0,xf,A,b,Pinv,P,D,d):
-    sqrtDi = np.sqrt(D[i])
-    sqrtDit = sqrtDi*dt0f
-    Px0i = np.sum(P[i,:]*x0)
-    Pxfi = np.sum(P[i,:]*xf)
-    numer1 = (np.exp(sqrtDit)-1)*(1/D[i]*self.ddi_dDu(i,u,P,Pinv,x0)-(i==u)*d[i]/D[i]**2)
-    numer2 = (i==u)*dt0f/(2*sqrtDi)*np.exp(sqrtDit)*(d[i]/D[i]-Px0i)
-    denom1 = np.exp(-sqrtDit)-np.exp(sqrtDit)
-    numer3 = (i==u)*self.c2i_n0(dt0f,Px0i,Pxfi,D[i],sqrtDi,d[i])*dt0f*(np.exp(-sqrtDit)+np.exp(sqrtDit))
-    denom2 = 2*sqrtDi*(np.exp(-sqrtDit)-np.exp(sqrtDit))
-    return (numer1+numer2)/denom1 + numer3/denom2
-
-  ###### Z-ZDOT INTEGRAL DERIVATIVES (|Dii| < eps)
-
-  def dint_z0_z0dot_dbu(self,k,l,u,dt,dk,dl,c1k,c1l,c2k,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu):
-    return np.sum(self.dint_z0_z0dot_dbu_p(k,l,u,dt,dk,dl,c1k,c1l,c2k,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu))
-
-  def dint_z0_z0dot_dbu_p(self,k,l,u,dt,dk,dl,c1k,c1l,c2k,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu):
-    dintzzdot_kl_1 = (dl*dk_dbu+dk*dl_dbu)/8*dt**4
-    dintzzdot_kl_2 = -(dk*dc1l_dbu+c1l*dk_dbu)/6*dt**3
-    dintzzdot_kl_3 = -(dl*dc1k_dbu+c1k*dl_dbu)/3*dt**3
-    dintzzdot_kl_4 = (c1l*dc1k_dbu+c1k*dc1l_dbu)/2*dt**2
-    dintzzdot_kl_5 = -(dl*dc2k_dbu+c2k*dl_dbu)/2*dt**2
-    dintzzdot_kl_6 = (c1l*dc2k_dbu+c2k*dc1l_dbu)*dt
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  def dint_z0_z0dot_dPuv(self,k,l,u,v,dt,dk,dl,c1k,c1l,c2k,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv):
-    return np.sum(self.dint_z0_z0dot_dPuv_p(k,l,u,v,dt,dk,dl,c1k,c1l,c2k,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv))
-
-  def dint_z0_z0dot_dPuv_p(self,k,l,u,v,dt,dk,dl,c1k,c1l,c2k,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv):
-    dintzzdot_kl_1 = (dl*dk_dPuv+dk*dl_dPuv)/8*dt**4
-    dintzzdot_kl_2 = -(dk*dc1l_dPuv+c1l*dk_dPuv)/6*dt**3
-    dintzzdot_kl_3 = -(dl*dc1k_dPuv+c1k*dl_dPuv)/3*dt**3
-    dintzzdot_kl_4 = (c1l*dc1k_dPuv+c1k*dc1l_dPuv)/2*dt**2
-    dintzzdot_kl_5 = -(dl*dc2k_dPuv+c2k*dl_dPuv)/2*dt**2
-    dintzzdot_kl_6 = (c1l*dc2k_dPuv+c2k*dc1l_dPuv)*dt
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  def dint_z0_z0dot_dDu(self,k,l,u,dt,dk,dl,c1k,c1l,c2k,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu):
-    return np.sum(self.dint_z0_z0dot_dDu_p(k,l,u,dt,dk,dl,c1k,c1l,c2k,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu))
-
-  def dint_z0_z0dot_dDu_p(self,k,l,u,dt,dk,dl,c1k,c1l,c2k,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu):
-    dintzzdot_kl_1 = (dl*dk_dDu+dk*dl_dDu)/8*dt**4
-    dintzzdot_kl_2 = -(dk*dc1l_dDu+c1l*dk_dDu)/6*dt**3
-    dintzzdot_kl_3 = -(dl*dc1k_dDu+c1k*dl_dDu)/3*dt**3
-    dintzzdot_kl_4 = (c1l*dc1k_dDu+c1k*dc1l_dDu)/2*dt**2
-    dintzzdot_kl_5 = -(dl*dc2k_dDu+c2k*dl_dDu)/2*dt**2
-    dintzzdot_kl_6 = (c1l*dc2k_dDu+c2k*dc1l_dDu)*dt
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  ###### Z-ZDOT INTEGRAL DERIVATIVES (|Dkk| < eps, |Dll| >= eps)
-
-  def dint_z0_zn0dot_dbu(self,k,l,u,dt,dk,Dl,c1k,c1l,c2k,c2l,dk_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu,dc2l_dbu):
-    return np.sum(self.dint_z0_zn0dot_dbu_p(k,l,u,dt,dk,Dl,c1k,c1l,c2k,c2l,dk_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu,dc2l_dbu))
-
-  def dint_z0_zn0dot_dbu_p(self,k,l,u,dt,dk,Dl,c1k,c1l,c2k,c2l,dk_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu,dc2l_dbu):
-    sqrtDl = np.sqrt(Dl)
-    sqrtDlt = sqrtDl*dt
-
-    dintzzdot_kl_1 = -(dk_dbu*c1l+dc1l_dbu*dk)/(2*Dl)*(np.exp(sqrtDlt)*((sqrtDlt-1)**2+1)-2)
-    dintzzdot_kl_2 = -(dk_dbu*c2l+dc2l_dbu*dk)/(2*Dl)*(np.exp(-sqrtDlt)*((-sqrtDlt-1)**2+1)-2)
-    dintzzdot_kl_3 = (dc1k_dbu*c1l+c1k*dc1l_dbu)/sqrtDl*(np.exp(sqrtDlt)*(sqrtDlt-1)+1)
-    dintzzdot_kl_4 = -(dc1k_dbu*c2l+dc2l_dbu*c1k)/sqrtDl*(np.exp(-sqrtDlt)*(-sqrtDlt-1)+1)
-    dintzzdot_kl_5 = (dc2k_dbu*c1l+dc1l_dbu*c2k)*(np.exp(sqrtDlt)-1)
-    dintzzdot_kl_6 = (dc2k_dbu*c2l+dc2l_dbu*c2k)*(np.exp(-sqrtDlt)-1)
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  def dint_z0_zn0dot_dPuv(self,k,l,u,v,dt,dk,c1k,c1l,c2k,c2l,dk_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv,dc2l_dPuv):
-    return np.sum(self.dint_z0_zn0dot_dPuv_p(k,l,u,v,dt,dk,c1k,c1l,c2k,c2l,dk_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv,dc2l_dPuv))
-
-  def dint_z0_zn0dot_dPuv_p(self,k,l,u,v,dt,dk,c1k,c1l,c2k,c2l,dk_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv,dc2l_dPuv):
-    sqrtDl = np.sqrt(Dl)
-    sqrtDlt = sqrtDl*dt
-
-    dintzzdot_kl_1 = -(dk_dPuv*c1l+dc1l_dPuv*dk)/(2*Dl)*(np.exp(sqrtDlt)*((sqrtDlt-1)**2+1)-2)
-    dintzzdot_kl_2 = -(dk_dPuv*c2l+dc2l_dPuv*dk)/(2*Dl)*(np.exp(-sqrtDlt)*((-sqrtDlt-1)**2+1)-2)
-    dintzzdot_kl_3 = (dc1k_dPuv*c1l+c1k*dc1l_dPuv)/sqrtDl*(np.exp(sqrtDlt)*(sqrtDlt-1)+1)
-    dintzzdot_kl_4 = -(dc1k_dPuv*c2l+dc2l_dPuv*c1k)/sqrtDl*(np.exp(-sqrtDlt)*(-sqrtDlt-1)+1)
-    dintzzdot_kl_5 = (dc2k_dPuv*c1l+dc1l_dPuv*c2k)*(np.exp(sqrtDlt)-1)
-    dintzzdot_kl_6 = (dc2k_dPuv*c2l+dc2l_dPuv*c2k)*(np.exp(-sqrtDlt)-1)
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  def dint_z0_zn0dot_dDu(self,k,l,u,dt,dk,c1k,c1l,c2k,c2l,dk_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu):
-    return np.sum(self.dint_z0_zn0dot_dDu_p(k,l,u,dt,dk,c1k,c1l,c2k,c2l,dk_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu))
-
-  def dint_z0_zn0dot_dDu_p(self,k,l,u,dt,dk,c1k,c1l,c2k,c2l,dk_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu):
-    sqrtDl = np.sqrt(Dl)
-    sqrtDlt = sqrtDl*dt
-
-    dintzzdot_kl_1 = -(dk_dDu*c1l+dc1l_dDu*dk)/(2*Dl)*(np.exp(sqrtDlt)*((sqrtDlt-1)**2+1)-2) - \
-      (u==l)*dk*c1l/(2*Dl**2)*(2+np.exp(sqrtDlt)*(1/2*sqrtDlt**3-sqrtDlt**2+2*sqrtDlt-2))
-    dintzzdot_kl_2 = -(dk_dDu*c2l+dc2l_dDu*dk)/(2*Dl)*(np.exp(-sqrtDlt)*((-sqrtDlt-1)**2+1)-2) + \
-      (u==l)*dk*c2l/(2*Dl**2)*(2+np.exp(-sqrtDlt)*(-1/2*sqrtDlt**3-sqrtDlt**2-2*sqrtDlt-2))
-    dintzzdot_kl_3 = (dc1k_dDu*c1l+c1k*dc1l_dDu)/sqrtDl*(np.exp(sqrtDlt)*(sqrtDlt-1)+1) + \
-      (u==l)*c1k*c1l/(sqrtDl*Dl)*(np.exp(sqrtDlt)*(1/2*dt**2-1/2*sqrtDlt+1/2)+(1/2*sqrtDlt-1))
-    dintzzdot_kl_4 = -(dc1k_dDu*c2l+dc2l_dDu*c1k)/sqrtDl*(np.exp(-sqrtDlt)*(-sqrtDlt-1)+1) - \
-      (u==l)*c1k*c2l/(sqrtDl*Dl)*(np.exp(-sqrtDlt)*(1/2*dt**2+1/2*sqrtDlt+1/2)+(-1/2*sqrtDlt-1))
-    dintzzdot_kl_5 = (dc2k_dDu*c1l+dc1l_dDu*c2k)*(np.exp(sqrtDlt)-1) + \
-      (u==l)*c2k*c1l*sqrtDlt*np.exp(sqrtDlt)
-    dintzzdot_kl_6 = (dc2k_dDu*c2l+dc2l_dDu*c2k)*(np.exp(-sqrtDlt)-1) - \
-      (u==l)*c2k*c2l*sqrtDlt*np.exp(-sqrtDlt)
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  ###### Z-ZDOT INTEGRAL DERIVATIVES (|Dkk| >= eps, |Dll| < eps)
-
-  def dint_zn0_z0dot_dbu(self,k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu):
-    return np.sum(self.dint_zn0_z0dot_dbu_p(k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu))
-
-  def dint_zn0_z0dot_dbu_p(self,k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu):
-    sqrtDk = np.sqrt(Dk)
-    sqrtDkt = sqrtDk*dt
-
-    dintzzdot_kl_1 = -dt**2/(2*Dk)*(dk_dbu*dl+dl_dbu*dk)
-    dintzzdot_kl_2 = dt/Dk*(dk_dbu*c1l+dc1l_dbu*dk)
-    dintzzdot_kl_3 = -1/Dk*(np.exp(sqrtDkt)*(sqrtDk-1)+1)*(dl_dbu*c1k*+dc1k_dbu*dl)
-    dintzzdot_kl_4 = 1/sqrtDk*(np.exp(sqrtDkt)-1)*(dc1k_dbu*c1l+dc1l_dbu*c1k)
-    dintzzdot_kl_5 = -1/Dk*(np.exp(-sqrtDkt)*(-sqrtDkt-1)+1)*(dl_dbu*c2k+dc2k_dbu*dl)
-    dintzzdot_kl_6 = -1/sqrtDk*(np.exp(-sqrtDkt)-1)*(dc2k_dbu*c1l+dc1l_dbu*c2k)
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  def dint_zn0_z0dot_dPuv(self,k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv):
-    return np.sum(self.dint_zn0_z0dot_dPuv_p(k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv))
-
-  def dint_zn0_z0dot_dPuv_p(self,k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv):
-    sqrtDk = np.sqrt(Dk)
-    sqrtDkt = sqrtDk*dt
-
-    dintzzdot_kl_1 = -dt**2/(2*Dk)*(dk_dPuv*dl+dl_dPuv*dk)
-    dintzzdot_kl_2 = dt/Dk*(dk_dPuv*c1l+dc1l_dPuv*dk)
-    dintzzdot_kl_3 = -1/Dk*(np.exp(sqrtDkt)*(sqrtDk-1)+1)*(dl_dPuv*c1k*+dc1k_dPuv*dl)
-    dintzzdot_kl_4 = 1/sqrtDk*(np.exp(sqrtDkt)-1)*(dc1k_dPuv*c1l+dc1l_dPuv*c1k)
-    dintzzdot_kl_5 = -1/Dk*(np.exp(-sqrtDkt)*(-sqrtDkt-1)+1)*(dl_dPuv*c2k+dc2k_dPuv*dl)
-    dintzzdot_kl_6 = -1/sqrtDk*(np.exp(-sqrtDkt)-1)*(dc2k_dPuv*c1l+dc1l_dPuv*c2k)
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  def dint_zn0_z0dot_dDu(self,k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu):
-    return np.sum(self.dint_zn0_z0dot_dDu_p(k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu))
-
-  def dint_zn0_z0dot_dDu_p(self,k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu):
-    sqrtDk = np.sqrt(Dk)
-    sqrtDkt = sqrtDk*dt
-
-    dintzzdot_kl_1 = -dt**2/(2*Dk)*(dk_dDu*dl+dl_dDu*dk) + (u==k)*dk*dl/(2*Dk**2)*dt**2
-    dintzzdot_kl_2 = dt/Dk*(dk_dDu*c1l+dc1l_dDu*dk) - (u==k)*dk*c1l/(Dk**2)*dt
-    dintzzdot_kl_3 = -1/Dk*(np.exp(sqrtDkt)*(sqrtDk-1)+1)*(dl_dDu*c1k*+dc1k_dDu*dl) - \
-      (u==k)*c1k*dl/(Dk**2)*(np.exp(sqrtDkt)*(1/2*dt**2-sqrtDkt+1)+(1/2*sqrtDkt-1))
-    dintzzdot_kl_4 = 1/sqrtDk*(np.exp(sqrtDkt)-1)*(dc1k_dDu*c1l+dc1l_dDu*c1k) + \
-      (u==k)*c1k*c1l/(sqrtDk*Dk)*(np.exp(sqrtDkt)*(1/2*dt-1)+1)
-    dintzzdot_kl_5 = -1/Dk*(np.exp(-sqrtDkt)*(-sqrtDkt-1)+1)*(dl_dDu*c2k+dc2k_dDu*dl) - \
-      (u==k)*c2k*dl/(Dk**2)*(np.exp(-sqrtDkt)*(1/2*dt**2+sqrtDkt+1)+(-1/2*sqrtDkt-1))
-    dintzzdot_kl_6 = -1/sqrtDk*(np.exp(-sqrtDkt)-1)*(dc2k_dDu*c1l+dc1l_dDu*c2k) - \
-      (u==k)*c2k*c1l/(sqrtDk*Dk)*(np.exp(-sqrtDkt)*(1/2*dt-1)+1)
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  ###### Z-ZDOT INTEGRAL DERIVATIVES (|Dii| >= eps)
-
-  def dint_zn0_zn0dot_dbu(self,k,l,u,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu,dc2l_dbu):
-    return np.sum(self.dint_zn0_zn0dot_dbu_p(k,l,u,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu,dc2l_dbu))
-
-  def dint_zn0_zn0dot_dbu_p(self,k,l,u,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu,dc2l_dbu):
-    sqrtDk = np.sqrt(Dk)
-    sqrtDl = np.sqrt(Dl)
-    sqrtDkt = sqrtDk*dt
-    sqrtDlt = sqrtDl*dt
-
-    dintzzdot_kl_1 = (dk_dbu*c1l+dc1l_dbu*dk)/Dk*(np.exp(sqrtDlt)-1)
-    dintzzdot_kl_2 = (dk_dbu*c2l+dc2l_dbu*dk)/Dk*(np.exp(-sqrtDlt)-1)
-    dintzzdot_kl_3 = (dc1k_dbu*c1l+dc1l_dbu*c1k)*sqrtDl/(sqrtDk+sqrtDl)*(np.exp(sqrtDkt+sqrtDlt)-1)
-    if np.allclose(sqrtDk,sqrtDl):
-      dintzzdot_kl_4 = -(dc1k_dbu*c2l+dc2l_dbu*c1k)*sqrtDl*dt
-      dintzzdot_kl_5 = (dc2k_dbu*c1l+dc1l_dbu*c2k)*sqrtDl*dt
+  def dA_dP(self,Pinv,P,D):
+    # dAij_dPuv for all u,v,i,j at once
+    PinvDP = (Pinv*D).dot(P)
+    return -np.einsum('iu,u,vj->uvij',Pinv,D,np.eye(self.XDim)) + \
+      np.einsum('iu,vj->uvij',Pinv,PinvDP)
+
+  def dA_dD(self,Pinv,P):
+    # dAij_dDu for all u,i,j at once
+    return -np.einsum('iu,uj->uij',Pinv,P)
+
+  ###### Z-ZDOT INTEGRAL DERIVATIVES (ANY Dii)
+
+  # Paths are handled as lists of (coef,p,a) terms, coef*t**p*exp(a*t).
+  # z_i is linear in (Px0i,Pxfi,di), so its derivatives wrt those are the
+  # paths for unit inputs. w_i = dz_i/dD_i solves wddot_i = D_i*w_i + z_i
+  # with w_i = 0 at both ends, since z_i(0) and z_i(dt0f) are pinned.
+
+  def zw_terms(self,dt,di,Di,Px0i,Pxfi):
+    if np.abs(Di) < self.eps:
+      c1i = self.c1i_0(dt,Px0i,Pxfi,di)
+      c2i = self.c2i_0(Px0i)
+      z = [(-di/2,2,0.),(c1i,1,0.),(c2i,0,0.)]
+      w = [(-di/24,4,0.),(c1i/6,3,0.),(c2i/2,2,0.)]
     else:
-      dintzzdot_kl_4 = -(dc1k_dbu*c2l+dc2l_dbu*c1k)*sqrtDl/(sqrtDk-sqrtDl)*(np.exp(sqrtDkt-sqrtDlt)-1)
-      dintzzdot_kl_5 = -(dc2k_dbu*c1l+dc1l_dbu*c2k)*sqrtDl/(sqrtDk-sqrtDl)*(np.exp(-sqrtDkt+sqrtDlt)-1)
-    dintzzdot_kl_6 = (dc2k_dbu*c2l+dc2l_dbu*c2k)*sqrtDl/(sqrtDk+sqrtDl)*(np.exp(-sqrtDkt-sqrtDlt)-1)
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  def dint_zn0_zn0dot_dPuv(self,k,l,u,v,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv,dc2l_dPuv):
-    return np.sum(self.dint_zn0_zn0dot_dPuv_p(k,l,u,v,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv,dc2l_dPuv))
-
-  def dint_zn0_zn0dot_dPuv_p(self,k,l,u,v,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv,dc2l_dPuv):
-    sqrtDk = np.sqrt(Dk)
-    sqrtDl = np.sqrt(Dl)
-    sqrtDkt = sqrtDk*dt
-    sqrtDlt = sqrtDl*dt
-
-    dintzzdot_kl_1 = (dk_dPuv*c1l+dc1l_dPuv*dk)/Dk*(np.exp(sqrtDlt)-1)
-    dintzzdot_kl_2 = (dk_dPuv*c2l+dc2l_dPuv*dk)/Dk*(np.exp(-sqrtDlt)-1)
-    dintzzdot_kl_3 = (dc1k_dPuv*c1l+dc1l_dPuv*c1k)*sqrtDl/(sqrtDk+sqrtDl)*(np.exp(sqrtDkt+sqrtDlt)-1)
-    if np.allclose(sqrtDk,sqrtDl):
-      dintzzdot_kl_4 = -(dc1k_dPuv*c2l+dc2l_dPuv*c1k)*sqrtDl*dt
-      dintzzdot_kl_5 = (dc2k_dPuv*c1l+dc1l_dPuv*c2k)*sqrtDl*dt
+      sqrtDi = np.sqrt(Di)
+      c1i = self.c1i_n0(dt,Px0i,Pxfi,Di,sqrtDi,di)
+      c2i = self.c2i_n0(dt,Px0i,Pxfi,Di,sqrtDi,di)
+      z = [(di/Di,0,0.),(c1i,0,sqrtDi),(c2i,0,-sqrtDi)]
+      w = [(-di/Di**2,0,0.),(c1i/(2*sqrtDi),1,sqrtDi),
+           (-c2i/(2*sqrtDi),1,-sqrtDi)]
+    # Homogeneous part of w fixing w(0) = w(dt) = 0
+    w0, wdt = self.eval_terms(w,0.), self.eval_terms(w,dt)
+    if np.abs(Di) < self.eps:
+      w += [(-w0,0,0.),(-(wdt-w0)/dt,1,0.)]
     else:
-      dintzzdot_kl_4 = -(dc1k_dPuv*c2l+dc2l_dPuv*c1k)*sqrtDl/(sqrtDk-sqrtDl)*(np.exp(sqrtDkt-sqrtDlt)-1)
-      dintzzdot_kl_5 = -(dc2k_dPuv*c1l+dc1l_dPuv*c2k)*sqrtDl/(sqrtDk-sqrtDl)*(np.exp(-sqrtDkt+sqrtDlt)-1)
-    dintzzdot_kl_6 = (dc2k_dPuv*c2l+dc2l_dPuv*c2k)*sqrtDl/(sqrtDk+sqrtDl)*(np.exp(-sqrtDkt-sqrtDlt)-1)
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6])
-
-  def dint_zn0_zn0dot_dDu(self,k,l,u,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu,dc2l_dDu):
-    return np.sum(self.dint_zn0_zn0dot_dDu_p(k,l,u,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu,dc2l_dDu))
-
-  def dint_zn0_zn0dot_dDu_p(self,k,l,u,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu,dc2l_dDu):
-    sqrtDk = np.sqrt(Dk)
-    sqrtDl = np.sqrt(Dl)
-    sqrtDkt = sqrtDk*dt
-    sqrtDlt = sqrtDl*dt
-
-    dintzzdot_kl_1 = (dk_dDu*c1l+dc1l_dDu*dk-(u==k)*dk*c1l/Dk)/Dk*(np.exp(sqrtDlt)-1) - \
-      dk*c1l*dt/(2*Dk*sqrtDl)*np.exp(sqrtDlt)
-    dintzzdot_kl_2 = (dk_dDu*c2l+dc2l_dDu*dk-(u==k)*dk*c2l/Dk)/Dk*(np.exp(-sqrtDlt)-1) - \
-      dk*c2l*dt/(2*Dk*sqrtDl)*np.exp(-sqrtDlt)
-    dintzzdot_kl_3 = (dc1k_dDu*c1l+dc1l_dDu*c1k)*sqrtDl/(sqrtDk+sqrtDl)*(np.exp(sqrtDkt+sqrtDlt)-1) + \
-      c1k*c1l/(2*(sqrtDk+sqrtDl)**2)*((u==l)*(sqrtDk/sqrtDl)-(u==k)*(sqrtDl/sqrtDk))*(np.exp(sqrtDkt+sqrtDlt)-1) + \
-      c1k*c1l*sqrtDl/(sqrtDk+sqrtDl)*dt/2*((u==k)/sqrtDk+(u==l)/sqrtDl)*np.exp(sqrtDkt+sqrtDlt)
-    if np.allclose(sqrtDk,sqrtDl):
-      dintzzdot_kl_4 = -(dc1k_dDu*c2l+dc2l_dDu*c1k)*sqrtDl*dt - (u==l)*c1k*c2l*dt/(2*sqrtDl)
-      dintzzdot_kl_5 = (dc2k_dDu*c1l+dc1l_dDu*c2k)*sqrtDl*dt + (u==k)*c2k*c1l*dt/(2*sqrtDl)
-    else:
-      dintzzdot_kl_4 = -(dc1k_dDu*c2l+dc2l_dDu*c1k)*sqrtDl/(sqrtDk-sqrtDl)*(np.exp(sqrtDkt-sqrtDlt)-1) - \
-        c1k*c2l/(2*(sqrtDk-sqrtDl)**2)*((u==l)*(sqrtDk/sqrtDl)-(u==k)*(sqrtDl/sqrtDk))*(np.exp(sqrtDkt-sqrtDlt)-1) - \
-        c1k*c2l*sqrtDl/(sqrtDk-sqrtDl)*dt/2*((u==k)/sqrtDk-(u==l)/sqrtDl)*np.exp(sqrtDkt-sqrtDlt)
-      dintzzdot_kl_5 = -(dc2k_dDu*c1l+dc1l_dDu*c2k)*sqrtDl/(sqrtDk-sqrtDl)*(np.exp(-sqrtDkt+sqrtDlt)-1) - \
-        c2k*c1l/(2*(sqrtDk-sqrtDl)**2)*((u==l)*(sqrtDk/sqrtDl)-(u==k)*(sqrtDl/sqrtDk))*(np.exp(-sqrtDkt+sqrtDlt)-1) + \
-        c2k*c1l*sqrtDl/(sqrtDk-sqrtDl)*dt/2*((u==k)/sqrtDk-(u==l)/sqrtDl)*np.exp(-sqrtDkt+sqrtDlt)
-    dintzzdot_kl_6 = (dc2k_dDu*c2l+dc2l_dDu*c2k)*sqrtDl/(sqrtDk+sqrtDl)*(np.exp(-sqrtDkt-sqrtDlt)-1) + \
-      c2k*c2l/(2*(sqrtDk+sqrtDl)**2)*((u==l)*(sqrtDk/sqrtDl)-(u==k)*(sqrtDl/sqrtDk))*(np.exp(-sqrtDkt-sqrtDlt)-1) - \
-      c2k*c2l*sqrtDl/(sqrtDk+sqrtDl)*dt/2*((u==k)/sqrtDk+(u==l)/sqrtDl)*np.exp(-sqrtDkt-sqrtDlt)
-
-    return np.asarray([dintzzdot_kl_1,dintzzdot_kl_2,dintzzdot_kl_3,
-                       dintzzdot_kl_4,dintzzdot_kl_5,dintzzdot_kl_6],dtype=np.complex)
-
-  def int_dint_zzdot(self,A,Pinv,P,D,b,dt,dt0f,zt,xt,x0,xf,sqrtD,Px0,Pxf,d):
-    int_zzdot = np.zeros((self.XDim,)*2,dtype=np.complex)
-    dint_zzdot_db = np.zeros((self.XDim,)*3,dtype=np.complex)
-    dint_zzdot_dD = np.zeros((self.XDim,)*3,dtype=np.complex)
-    dint_zzdot_dP = np.zeros((self.XDim,)*4,dtype=np.complex)
+      e1 = (w0*np.exp(-sqrtDi*dt) - wdt)/(np.exp(sqrtDi*dt) - np.exp(-sqrtDi*dt))
+      w += [(e1,0,sqrtDi),(-w0-e1,0,-sqrtDi)]
+    return z, w
+
+  def eval_terms(self,f,t):
+    return sum(c*t**p*np.exp(a*t) for c,p,a in f)
+
+  def ddt_terms(self,f):
+    df = [(c*a,p,a) for c,p,a in f if a != 0]
+    return df + [(c*p,p-1,a) for c,p,a in f if p > 0]
+
+  def int_terms(self,f,g,dt):
+    # int_0^dt f*g
+    return sum(cf*cg*self.int_tpexp(pf+pg,af+ag,dt)
+               for cf,pf,af in f for cg,pg,ag in g)
+
+  def int_tpexp(self,p,a,dt):
+    # int_0^dt t**p*exp(a*t); series near a*dt = 0 where the recursion
+    # I_p = (dt**p*exp(a*dt) - p*I_(p-1))/a cancels badly
+    if np.abs(a*dt) < 1:
+      return sum(a**n*dt**(n+p+1)/(factorial(n)*(n+p+1)) for n in range(30))
+    I = (np.exp(a*dt)-1)/a
+    for q in range(1,p+1):
+      I = (dt**q*np.exp(a*dt) - q*I)/a
+    return I
+
+  def int_dint_zzdot(self,P,D,b,dt,dt0f,x0,xf,Px0,Pxf,d):
+    batch = Px0.shape[:-1]
+    int_zzdot = np.zeros(batch+(self.XDim,)*2,dtype=complex)
+    dint_zzdot_db = np.zeros(batch+(self.XDim,)*3,dtype=complex)
+    dint_zzdot_dD = np.zeros(batch+(self.XDim,)*3,dtype=complex)
+    dint_zzdot_dP = np.zeros(batch+(self.XDim,)*4,dtype=complex)
+
+    zs, ws, units = [], [], []
+    for i in range(self.XDim):
+      z, w = self.zw_terms(dt0f,d[i],D[i],Px0[...,i],Pxf[...,i])
+      zs += [z]
+      ws += [w]
+      # dz_i/dPx0i, dz_i/dPxfi, dz_i/ddi
+      units += [[self.zw_terms(dt0f,0.,D[i],1.,0.)[0],
+                 self.zw_terms(dt0f,0.,D[i],0.,1.)[0],
+                 self.zw_terms(dt0f,1.,D[i],0.,0.)[0]]]
+    zdots = [self.ddt_terms(z) for z in zs]
 
     for k,l in crossprod(*([range(self.XDim)]*2)):
+      int_zzdot[...,k,l] = self.int_terms(zs[k],zdots[l],dt)
 
-      Px0k, Px0l = Px0[k], Px0[l]
-      Pxfk, Pxfl = Pxf[k], Pxf[l]
-      dk, dl = d[k], d[l]
-      Dk, Dl = D[k], D[l]
-      sqrtDk, sqrtDl = np.sqrt(Dk), np.sqrt(Dl)
+      # z_k only moves with D_k, P[k,:] and b (through d_k = P[k,:].b)
+      dint_zzdot_dD[...,k,k,l] += self.int_terms(ws[k],zdots[l],dt)
+      dint_zzdot_dD[...,l,k,l] += self.int_terms(zs[k],self.ddt_terms(ws[l]),dt)
 
-      kc = np.abs(Dk) < self.eps
-      lc = np.abs(Dl) < self.eps
-
-      if kc:
-        # Dk = 0j
-        c1k = self.c1i_0(dt0f,Px0k,Pxfk,dk)
-        c2k = self.c2i_0(Px0k)
-      else:
-        c1k = self.c1i_n0(dt0f,Px0k,Pxfk,Dk,sqrtDk,dk)
-        c2k = self.c2i_n0(dt0f,Px0k,Pxfk,Dk,sqrtDk,dk)
-
-      if lc:
-        # Dl = 0j
-        c1l = self.c1i_0(dt0f,Px0l,Pxfl,dl)
-        c2l = self.c2i_0(Px0l)
-      else:
-        c1l = self.c1i_n0(dt0f,Px0l,Pxfl,Dl,sqrtDl,dl)
-        c2l = self.c2i_n0(dt0f,Px0l,Pxfl,Dl,sqrtDl,dl)
-
-      if kc and lc:
-        int_zzdot[k,l] = self.int_z0_z0dot(dt,dk,dl,c1k,c1l,c2k,c2l)
-      elif kc and not lc:
-        int_zzdot[k,l] = self.int_z0_zn0dot(dt,dk,Dl,sqrtDl,c1k,c1l,c2k,c2l)
-      elif not kc and lc:
-        int_zzdot[k,l] = self.int_zn0_z0dot(dt,dk,dl,Dk,sqrtDk,c1k,c1l,c2k)
-      elif not kc and not lc:
-        int_zzdot[k,l] = self.int_zn0_zn0dot(dt,dk,dl,Dk,Dl,sqrtDk,sqrtDl,c1k,c1l,c2k,c2l)
-
-      for u in range(self.XDim):
-
-        dk_dbu = self.ddi_dbu(k,u,P)
-        dl_dbu = self.ddi_dbu(l,u,P)
-        dk_dDu = self.ddi_dDu(k,u,P,Pinv,x0)
-        dl_dDu = self.ddi_dDu(l,u,P,Pinv,x0)
-
-        if kc:
-          dc1k_dbu = self.dc01i_dbu(k,u,dt0f,P)
-          dc2k_dbu = self.dc02i_dbu(k,u)
-          dc1k_dDu = self.dc01i_dDu(k,u,dt0f,P,Pinv,x0)
-          dc2k_dDu = self.dc02i_dDu(k,u)
-        else:
-          dc1k_dbu = self.dcn01i_dbu(k,u,dt0f,P,D)
-          dc2k_dbu = self.dcn02i_dbu(k,u,dt0f,P,D)
-          dc1k_dDu = self.dcn01i_dDu(k,u,dt0f,x0,xf,A,b,Pinv,P,D,d)
-          dc2k_dDu = self.dcn02i_dDu(k,u,dt0f,x0,xf,A,b,Pinv,P,D,d)
-
-        if lc:
-          dc1l_dbu = self.dc01i_dbu(l,u,dt0f,P)
-          dc2l_dbu = self.dc02i_dbu(l,u)
-          dc1l_dDu = self.dc01i_dDu(l,u,dt0f,P,Pinv,x0)
-          dc2l_dDu = self.dc02i_dDu(l,u)
-        else:
-          dc1l_dbu = self.dcn01i_dbu(l,u,dt0f,P,D)
-          dc2l_dbu = self.dcn02i_dbu(l,u,dt0f,P,D)
-          dc1l_dDu = self.dcn01i_dDu(l,u,dt0f,x0,xf,A,b,Pinv,P,D,d)
-          dc2l_dDu = self.dcn02i_dDu(l,u,dt0f,x0,xf,A,b,Pinv,P,D,d)
-
-        if kc and lc:
-          dint_zzdot_db[u,k,l] = self.dint_z0_z0dot_dbu(k,l,u,dt,dk,dl,c1k,c1l,c2k,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu)
-          dint_zzdot_dD[u,k,l] = self.dint_z0_z0dot_dDu(k,l,u,dt,dk,dl,c1k,c1l,c2k,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu)
-        elif kc and not lc:
-          dint_zzdot_db[u,k,l] = self.dint_z0_zn0dot_dbu(k,l,u,dt,dk,Dl,c1k,c1l,c2k,c2l,dk_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu,dc2l_dbu)
-          dint_zzdot_dD[u,k,l] = self.dint_z0_zn0dot_dDu(k,l,u,dt,dk,c1k,c1l,c2k,c2l,dk_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu)
-        elif not kc and lc:
-          dint_zzdot_db[u,k,l] = self.dint_zn0_z0dot_dbu(k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu)
-          dint_zzdot_dD[u,k,l] = self.dint_zn0_z0dot_dDu(k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu)
-        elif not kc and not lc:
-          dint_zzdot_db[u,k,l] = self.dint_zn0_zn0dot_dbu(k,l,u,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dbu,dl_dbu,dc1k_dbu,dc1l_dbu,dc2k_dbu,dc2l_dbu)
-          dint_zzdot_dD[u,k,l] = self.dint_zn0_zn0dot_dDu(k,l,u,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dDu,dl_dDu,dc1k_dDu,dc1l_dDu,dc2k_dDu,dc2l_dDu)
-
-        for v in range(self.XDim):
-
-          dk_dPuv = self.ddi_dPuv(k,u,v,b)
-          dl_dPuv = self.ddi_dPuv(l,u,v,b)
-
-          if kc:
-            dc1k_dPuv = self.dc01i_dPuv(k,u,v,dt0f,xf,x0,A,b,Pinv,P,D)
-            dc2k_dPuv = self.dc02i_dPuv(k,u,v,x0)
-          else:
-            dc1k_dPuv = self.dcn01i_dPuv(k,u,v,dt0f,x0,xf,A,b,Pinv,P,D)
-            dc2k_dPuv = self.dcn02i_dPuv(k,u,v,dt0f,x0,xf,A,b,Pinv,P,D)
-
-          if lc:
-            dc1l_dPuv = self.dc01i_dPuv(l,u,v,dt0f,xf,x0,A,b,Pinv,P,D)
-            dc2l_dPuv = self.dc02i_dPuv(l,u,v,x0)
-          else:
-            dc1l_dPuv = self.dcn01i_dPuv(l,u,v,dt0f,x0,xf,A,b,Pinv,P,D)
-            dc2l_dPuv = self.dcn02i_dPuv(l,u,v,dt0f,x0,xf,A,b,Pinv,P,D)
-
-          if kc and lc:
-            dint_zzdot_dP[u,v,k,l] = self.dint_z0_z0dot_dPuv(k,l,u,v,dt,dk,dl,c1k,c1l,c2k,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv)
-          elif kc and not lc:
-            dint_zzdot_dP[u,v,k,l] = self.dint_z0_zn0dot_dPuv(k,l,u,v,dt,dk,c1k,c1l,c2k,c2l,dk_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv,dc2l_dPuv)
-          elif not kc and lc:
-            dint_zzdot_dP[u,v,k,l] = self.dint_zn0_z0dot_dPuv(k,l,u,dt,dk,dl,Dk,c1k,c1l,c2k,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv)
-          elif not kc and not lc:
-            dint_zzdot_dP[u,v,k,l] = self.dint_zn0_zn0dot_dPuv(k,l,u,v,dt,dk,dl,Dk,Dl,c1k,c1l,c2k,c2l,dk_dPuv,dl_dPuv,dc1k_dPuv,dc1l_dPuv,dc2k_dPuv,dc2l_dPuv)
+      dk = [np.asarray(self.int_terms(f,zdots[l],dt))[...,None]
+            for f in units[k]]
+      dl = [np.asarray(self.int_terms(zs[k],self.ddt_terms(f),dt))[...,None]
+            for f in units[l]]
+      dint_zzdot_db[...,:,k,l] += dk[2]*P[k] + dl[2]*P[l]
+      dint_zzdot_dP[...,k,:,k,l] += dk[0]*x0 + dk[1]*xf + dk[2]*b
+      dint_zzdot_dP[...,l,:,k,l] += dl[0]*x0 + dl[1]*xf + dl[2]*b
 
     return int_zzdot, dint_zzdot_db, dint_zzdot_dD, dint_zzdot_dP
-
-
-
@@ -192,6 +192,50 @@ class MLN(Domain):
 
         return np.hstack([delta.flatten() for delta in [dfi_dqij,dfi_dxid,dLRi_dBid,dLRi_dbi]])
 
+    def Jv(self,Data,Psi,F_Data=None):
+        # J(Data)*Psi treating the news tip and labels as locally constant
+        I,J,D = self.I, self.J, self.D
+        qij, xid, Bid, bi = self.UnpackData(Data)
+        Psi = Psi.reshape((Data.size,-1))
+        ptr = 0
+        dq = Psi[ptr:ptr+I*J].reshape((I,J,-1))
+        ptr += I*J
+        dx = Psi[ptr:ptr+I*D].reshape((I,D,-1))
+        ptr += I*D
+        dB = Psi[ptr:ptr+I*D].reshape((I,D,-1))
+        ptr += I*D
+        db = Psi[ptr:ptr+I].reshape((I,-1))
+
+        dij = self.Distances(xid)
+        yi = self.y(xid)
+        pyx = self.Py_x(yi,xid,Bid,bi)
+
+        # (x_i - x_j) G_j and its directional derivative (G_j symmetric)
+        xG = np.array([np.dot(xid-self.xjd[j],self.Gj[j]) for j in range(J)])
+        dxG = np.array([np.einsum('idk,de->iek',dx,self.Gj[j])
+                        for j in range(J)])
+        ddij = np.einsum('jid,idk->ijk',xG,dx)/dij[:,:,None]
+
+        ddfi_dqij = -self.pbj[:,None]*np.sum(dq,axis=0) - \
+            self.pbj[:,None]*dq + 2*self.ri[:,None,None]*dq + \
+            self.ci[:,None,None]*ddij
+        ddfi_dxid = 2*self.gami[:,None,None]*dx + \
+            2*self.ci[:,None,None]*(np.einsum('ijk,jid->idk',dq,xG) +
+                                    np.einsum('ij,jidk->idk',qij,dxG)) + \
+            2*self.alphai[:,None,None]*(
+                (dB*xid[:,:,None]+Bid[:,:,None]*dx-db[:,None,:])*Bid[:,:,None] +
+                ((Bid*xid).T-bi).T[:,:,None]*dB)
+        ds = yi[:,None]*(np.einsum('idk,id->ik',dB,xid) +
+                         np.einsum('id,idk->ik',Bid,dx) + db)
+        dpyx = pyx*(1-pyx)
+        ddLRi_dBid = self.Ki[:,None,None]*dB + \
+            (yi*dpyx)[:,None,None]*ds[:,None,:]*xid[:,:,None] - \
+            (yi*(1-pyx))[:,None,None]*dx
+        ddLRi_dbi = self.Ki[:,None]*db + (yi*dpyx)[:,None]*ds
+
+        return np.vstack([delta.reshape((-1,Psi.shape[1])) for delta in
+                          [ddfi_dqij,ddfi_dxid,ddLRi_dBid,ddLRi_dbi]])
+
 def CreateRandomNetwork(I=4,J=3,D=2,seed=None):
     if seed is not None:
         np.random.seed(seed)
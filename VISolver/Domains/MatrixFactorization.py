@@ -1,20 +1,29 @@
 import numpy as np
+from scipy.sparse import csr_matrix, coo_matrix
 
 from VISolver.Domain import Domain
 
 
 class MatrixFactorization(Domain):
 
-    def __init__(self,Data,sh_P,sh_Q,keepData=False):
+    def __init__(self,Data,sh_P,sh_Q,keepData=False,batch_size=None):
         self.Data = self.load_data(Data)
         self.keepData = keepData
         self.sh_P = sh_P
         self.sh_Q = sh_Q
         self.split = np.prod(sh_P)
         self.Dim = np.prod(sh_P) + np.prod(sh_Q)
+        # If set, F is a stochastic estimate from batch_size observed ratings
+        self.batch_size = batch_size
 
     def load_data(self,Data):
-        self.mask = (Data != 0).toarray()
+        # Only observed ratings are kept, as (rows,cols,vals) in CSR order
+        Data = csr_matrix(Data)
+        Data.sum_duplicates()
+        Data.eliminate_zeros()
+        self.rows = np.repeat(np.arange(Data.shape[0]),np.diff(Data.indptr))
+        self.cols = Data.indices
+        self.vals = Data.data
         return Data
 
     def unpack(self,parameters):
@@ -22,9 +31,12 @@ class MatrixFactorization(Domain):
         Q = parameters[self.split:].reshape(self.sh_Q)
         return P,Q
 
-    def predict(self,parameters):
+    def predict(self,parameters,rows=None,cols=None):
         P,Q = self.unpack(parameters)
-        return P.dot(Q.T)
+        if rows is None:
+            return P.dot(Q.T)
+        # Predictions for the (rows,cols) entries only
+        return np.einsum('ij,ij->i',P[rows],Q[cols])
 
     def rmse(self,pred,test,mask):
         sqerr = mask*np.asarray(pred - test)**2.
@@ -32,7 +44,18 @@ class MatrixFactorization(Domain):
 
     def F(self,parameters):
         P,Q = self.unpack(parameters)
-        err = self.mask*np.asarray(self.Data - P.dot(Q.T))
+        if self.batch_size is None:
+            err = self.vals - np.einsum('ij,ij->i',P[self.rows],Q[self.cols])
+            # Residuals share the sparsity pattern of Data
+            err = csr_matrix((err,self.cols,self.Data.indptr),
+                             shape=self.Data.shape)
+        else:
+            idx = np.random.randint(self.vals.size,size=self.batch_size)
+            rows, cols = self.rows[idx], self.cols[idx]
+            err = self.vals[idx] - np.einsum('ij,ij->i',P[rows],Q[cols])
+            # Rescaled to be unbiased for the full F; duplicates add up
+            err *= self.vals.size/float(self.batch_size)
+            err = coo_matrix((err,(rows,cols)),shape=self.Data.shape).tocsr()
         dP = err.dot(Q)
         dQ = err.T.dot(P)
         grad = np.hstack((dP.flatten(),dQ.flatten()))
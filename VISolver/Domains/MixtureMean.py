@@ -1,17 +1,22 @@
 import numpy as np
+from scipy.sparse import csr_matrix
 
 from VISolver.Domain import Domain
 
 
 class MixtureMean(Domain):
 
-    def __init__(self,Data,keepData=False,Dim=2):
+    def __init__(self,Data,keepData=False,Dim=2,batch_size=None):
         self.Data = self.load_data(Data)
         self.keepData = keepData
         self.Dim = Dim
+        # If set, F is a stochastic estimate from batch_size observed ratings
+        self.batch_size = batch_size
 
     def load_data(self,Data):
-        self.mask = (Data != 0).toarray()
+        Data = csr_matrix(Data)
+        Data.sum_duplicates()
+        Data.eliminate_zeros()
         globalmean = Data.sum()/Data.nnz
         usermean = np.asarray(Data.sum(axis=1)).squeeze()/Data.getnnz(axis=1)
         usermean[np.isnan(usermean)] = globalmean
@@ -19,6 +24,11 @@ class MixtureMean(Domain):
         moviemean[np.isnan(moviemean)] = globalmean
         self.usermean = np.expand_dims(usermean,axis=1)
         self.moviemean = np.expand_dims(moviemean,axis=0)
+        # Observed ratings with the user and movie means they are mixed from
+        rows = np.repeat(np.arange(Data.shape[0]),np.diff(Data.indptr))
+        self.vals = Data.data
+        self.obs_usermean = usermean[rows]
+        self.obs_moviemean = moviemean[Data.indices]
         return Data
 
     def predict(self,parameters):
@@ -32,11 +42,19 @@ class MixtureMean(Domain):
         return np.sqrt(sqerr.sum()/test.nnz)
 
     def F(self,parameters):
-        pred = self.predict(parameters)
-        rmse = self.rmse(pred,self.Data,self.mask)
-        diff = np.asarray(pred - self.Data)
-        dmu_user = np.sum((diff.T*self.usermean.squeeze()).T)
-        dmu_movie = np.sum(diff*self.moviemean.squeeze())
-        # grad = np.array([dmu_user,dmu_movie])/(rmse*self.Data.nnz)
-        grad = np.array([dmu_user-dmu_movie])/(rmse*self.Data.nnz)
+        vals = self.vals
+        usermean = self.obs_usermean
+        moviemean = self.obs_moviemean
+        if self.batch_size is not None:
+            idx = np.random.randint(vals.size,size=self.batch_size)
+            vals, usermean, moviemean = vals[idx], usermean[idx], moviemean[idx]
+        mu_user = parameters[0]
+        mu_movie = 1. - mu_user
+        # Residuals on observed ratings only
+        diff = mu_user*usermean + mu_movie*moviemean - vals
+        rmse = np.sqrt(np.mean(diff**2.))
+        dmu_user = np.mean(diff*usermean)
+        dmu_movie = np.mean(diff*moviemean)
+        # grad = np.array([dmu_user,dmu_movie])/rmse
+        grad = np.array([dmu_user-dmu_movie])/rmse
         return grad
@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.sparse as sp
 
 import matplotlib as mpl
 mpl.use("Agg")
@@ -176,6 +177,34 @@ class SOI(Domain):
 
         return F_packed
 
+    def Jv(self,Data,Psi,F_Data=None):
+
+        # F is affine in (Q,q,Pi), so J is assembled once and reused
+        if not hasattr(self,'J_QqPi'):
+            self.J_QqPi = self.Jacobian_QqPi()
+        return self.J_QqPi.dot(Psi.reshape((Data.size,-1)))
+
+    def Jacobian_QqPi(self):
+
+        m, n, o = self.Network
+        N, no = m*n*o, n*o
+
+        # dF_Q/dQ: demand prices, own-price feedback on the service
+        # provider's revenue, and production cost (all block diagonal in i
+        # except the cross-provider demand coupling)
+        C = np.reshape(self.coeff_rho_Q,(N,N))
+        own = sp.block_diag([C[i*no:(i+1)*no,i*no:(i+1)*no].T
+                             for i in range(m)])
+        prod = sp.block_diag([2.*self.coeff_f_Q[i]*np.ones((no,no))
+                              for i in range(m)])
+        dFQdQ = -(sp.csr_matrix(C)+own)+prod
+
+        eye = sp.identity(N)
+        return sp.bmat([[dFQdQ,sp.diags(-np.ravel(self.coeff_rho_q)),eye],
+                        [None,sp.diags(2.*np.ravel(self.coeff_c_q_pow2)),None],
+                        [-eye,None,sp.diags(2.*np.ravel(self.coeff_oc_Pi))]],
+                       format='csr')
+
     def ProductionCost_f(self,Q):
 
         return self.coeff_f_Q*np.sum(Q,axis=(1,2))**2+np.sum(Q,axis=(1,2))
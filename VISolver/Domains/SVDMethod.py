@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.sparse import csr_matrix
 from scipy.sparse.linalg import svds
 # from scipy.linalg import diagsvd
 
@@ -7,42 +8,121 @@ from VISolver.Domain import Domain
 
 class SVDMethod(Domain):
 
-    def __init__(self,Data,keepData=False,tau=1.,Dim=None):
+    def __init__(self,Data,keepData=False,tau=1.,Dim=None,k=10,warm=False,
+                 oversample=5,tol=1e-4,maxiter=20,seed=None):
         self.Data = self.load_data(Data)
         self.keepData = keepData
         self.tau = tau
         self.Dim = Dim
+        # warm=True swaps the cold svds for a subspace iteration started
+        # from the previous call's right singular vectors, with k grown
+        # until the smallest singular value found is below tau
+        self.k = k
+        self.warm = warm
+        self.oversample = oversample
+        self.tol = tol
+        self.maxiter = maxiter
+        # Gaussian start columns come from a private RandomState so F calls
+        # leave the global stream (and the caller's minibatches) alone
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+        self.V = None
         self.last_F = np.inf
 
     def load_data(self,Data):
-        self.mask = (Data != 0).toarray()
-        self.fro = np.linalg.norm(self.mask*Data.toarray(),ord='fro')
-        return Data.toarray()
+        # Observed ratings only: CSR plus their flat indices in the iterate
+        Data = csr_matrix(Data)
+        Data.sum_duplicates()
+        Data.eliminate_zeros()
+        self.rows = np.repeat(np.arange(Data.shape[0]),np.diff(Data.indptr))
+        self.cols = Data.indices
+        self.vals = Data.data
+        self.flat = self.rows*Data.shape[1] + self.cols
+        self.fro = np.linalg.norm(self.vals)
+        return Data
 
     def unpack(self,parameters):
         return parameters.reshape(self.Data.shape)
 
     def F(self,parameters):
-        R = self.shrink(self.unpack(parameters),self.tau)
-        # grad = np.asarray(self.Data-R)*self.mask
-        grad = (self.Data-R)*self.mask
-        self.last_F = grad
-        return grad.flatten()
-
-    def shrink(self,x,tau,k=10):
-        U, S, Vt = svds(x,k=k)
-        # U, S, Vt = np.linalg.svd(x,full_matrices=False)
-        # U, S, Vt = np.linalg.svd(x)
-        sub_thresh = (np.abs(S) <= tau)
-        S[sub_thresh] = 0.
-        S[~sub_thresh] = S[~sub_thresh] - np.sign(S[~sub_thresh])*tau
-        # s = np.clip(S-np.sign(S)*tau,0.,np.inf)
-        # R = U.dot(np.diag(s)).dot(Vt)
-        R = U.dot(np.diag(S)).dot(Vt)
+        Y = self.unpack(parameters)
+        U, S, Vt = self.svt(Y,self.tau)
+        # Residual of the low rank estimate, on observed ratings only
+        R = np.einsum('ij,ij->i',(U*S)[self.rows],
+                      np.ascontiguousarray(Vt.T)[self.cols])
+        self.last_F = self.vals - R
+        grad = np.zeros(Y.size)
+        grad[self.flat] = self.last_F
+        return grad
+
+    def shrink(self,x,tau,k=None):
+        U, S, Vt = self.svt(x,tau,k)
         # R = U.dot(diagsvd(s,U.shape[1],Vt.shape[0])).dot(Vt)
-        return R
+        return (U*S).dot(Vt)
+
+    def svt(self,x,tau,k=None):
+        '''Singular value soft thresholding of x, as the factors U, S, Vt of
+        the result.'''
+        if not np.any(x):
+            # svds cannot start from the zero matrix
+            return (np.zeros((x.shape[0],0)),np.zeros(0),
+                    np.zeros((0,x.shape[1])))
+        if self.warm:
+            U, S, Vt = self.warm_svds(x,tau,k)
+        else:
+            U, S, Vt = svds(x,k=self.k if k is None else k)
+            # U, S, Vt = np.linalg.svd(x,full_matrices=False)
+        # s = np.clip(S-np.sign(S)*tau,0.,np.inf)
+        keep = np.abs(S) > tau
+        S = S[keep] - np.sign(S[keep])*tau
+        return U[:,keep], S, Vt[keep]
+
+    def warm_svds(self,x,tau,k=None):
+        # The iterate lives on the observed entries when started from zero,
+        # in which case products with it only touch the nnz ratings
+        x_obs = x.ravel()[self.flat]
+        if np.count_nonzero(x) == np.count_nonzero(x_obs):
+            A = csr_matrix((x_obs,self.cols,self.Data.indptr),shape=x.shape)
+        else:
+            A = x
+        kmax = min(x.shape)
+        # Start from the rank carried over from the last call unless given
+        k = min(self.k if k is None else k,kmax)
+        V = self.V
+        while True:
+            U, S, Vt = self.subspace_svd(A,k,V)
+            # Done once the smallest value kept has dropped below tau
+            if S[k-1] <= tau or k >= kmax:
+                break
+            k = min(k+self.oversample,kmax)
+            V = Vt.T
+        # The next call only needs the values above tau plus one
+        self.k = max(int(np.sum(S[:k] > tau))+1,1)
+        self.V = Vt[:k].T
+        return U[:,:k], S[:k], Vt[:k]
+
+    def subspace_svd(self,A,k,V=None):
+        # Subspace iteration with k+oversample columns, started from V and
+        # topped up with Gaussian columns, until the leading k Ritz values
+        # settle to within tol
+        l = min(k+self.oversample,min(A.shape))
+        Omega = self.rng.randn(A.shape[1],l)
+        if V is not None:
+            r = min(V.shape[1],l)
+            Omega[:,:r] = V[:,:r]
+        S_old = None
+        for _ in range(self.maxiter):
+            Q = np.linalg.qr(A.dot(Omega))[0]
+            Ub, S, Vt = np.linalg.svd(np.asarray(A.T.dot(Q)).T,
+                                      full_matrices=False)
+            Omega = Vt.T
+            if S_old is not None and \
+               np.all(np.abs(S[:k]-S_old[:k]) <= self.tol*S[0]):
+                break
+            S_old = S
+        return Q.dot(Ub), S, Vt
 
     def rel_error(self,parameters):
-        err = np.linalg.norm(self.last_F,ord='fro')/self.fro
+        err = np.linalg.norm(self.last_F)/self.fro
         print(err)
         return err
@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.sparse as sp
 
 import matplotlib as mpl
 mpl.use("Agg")
@@ -12,11 +13,14 @@ from VISolver.Domain import Domain
 class SupplyChain(Domain):
     '''Current representation does not allow for different modes of
     transportation nor 'factory-direct' distribution.'''
-    def __init__(self,Network,alpha=2):
+    def __init__(self,Network,alpha=2,Fast=False):
         self.UnpackNetwork(Network)
         self.Network = (self.I,self.Nm,self.Nd,self.Nr)
         self.Dim = self.CalculateNetworkSize()
         self.alpha = alpha
+        self.Fast = Fast
+        if self.Fast:
+            self.CompileLayout()
 
         self.x_shape = [self.Network]
         self.lam_shapes = self.gam_shapes = [(self.I,self.Nm),
@@ -29,6 +33,8 @@ class SupplyChain(Domain):
         self.to_rgba = [cm.ScalarMappable(norm=norm, cmap=self.cmap).to_rgba]*4
 
     def F(self,Data):
+        if self.Fast:
+            return self.F_P2UP_Fast(Data)
         return self.F_P2UP(Data)
 
     # Functions Used to Animate and Save Network Run to Movie File
@@ -186,8 +192,9 @@ class SupplyChain(Domain):
 
     def CalculateNetworkSize(self):
 
-        return int(self.I*self.Nm*self.Nd*self.Nr * \
-            (1.+2./(self.Nd*self.Nr)+2./self.Nr+2./(self.Nm*self.Nr)+2./self.Nm))
+        return self.I*self.Nm*self.Nd*self.Nr + \
+            2*(self.I*self.Nm+self.I*self.Nm*self.Nd+self.I*self.Nd +
+               self.I*self.Nd*self.Nr)
 
     def PathFlow2LinkFlow_x2f(self,x):
 
@@ -216,6 +223,110 @@ class SupplyChain(Domain):
 
         return F_packed
 
+    def CompileLayout(self):
+
+        # Links are ordered like the gam (and lam) blocks of Data:
+        # IM, MD1, D1D2, D2R
+        I,Nm,Nd,Nr = self.Network
+        self.nX = I*Nm*Nd*Nr
+        sizes = [I*Nm,I*Nm*Nd,I*Nd,I*Nd*Nr]
+        off = np.cumsum([0]+sizes)
+        self.nL = off[-1]
+
+        # Link of every path at each level, paths in flattened (i,m,d,r)
+        # order; entries are sorted by level within each path so that
+        # A^T sums IM+MD1+D1D2+D2R in the same order as SumLinksOnPath_Edap
+        i,m,d,r = [np.ravel(j) for j in np.indices(self.Network)]
+        links = np.stack([off[0]+i*Nm+m,
+                          off[1]+(i*Nm+m)*Nd+d,
+                          off[2]+i*Nd+d,
+                          off[3]+(i*Nd+d)*Nr+r],axis=1).ravel()
+        paths = np.repeat(np.arange(self.nX),4)
+        self.A_PL = sp.csr_matrix((np.ones(links.size),(paths,links)),
+                                  shape=(self.nX,self.nL))
+        self.A_PL.has_sorted_indices = True
+        self.A_LP = self.A_PL.T.tocsr()
+        self.ir_P = i*Nr+r
+
+        # Per-link coefficients and firm weights stacked in the same order
+        def stack(*blocks):
+            return np.concatenate([np.ravel(blk) for blk in blocks])
+        levels = ['IM','MD1','D1D2','D2R']
+        self.c1_L = stack(*[getattr(self,'coeff_c_pow1_'+l) for l in levels])
+        self.c2_L = stack(*[getattr(self,'coeff_c_pow2_'+l) for l in levels])
+        self.g1_L = stack(*[getattr(self,'coeff_g_pow1_'+l) for l in levels])
+        self.g2_L = stack(*[getattr(self,'coeff_g_pow2_'+l) for l in levels])
+        self.ef1_L = stack(*[getattr(self,'coeff_e_f_pow1_'+l)
+                             for l in levels])
+        self.ef2_L = stack(*[getattr(self,'coeff_e_f_pow2_'+l)
+                             for l in levels])
+        self.eg1_L = stack(*[getattr(self,'coeff_e_g_pow1_'+l)
+                             for l in levels])
+        self.eg2_L = stack(*[getattr(self,'coeff_e_g_pow2_'+l)
+                             for l in levels])
+        self.u_L = stack(self.u_IM,self.u_MD1,self.u_D1D2,self.u_D2R)
+        firm_L = stack(np.indices((I,Nm))[0],np.indices((I,Nm,Nd))[0],
+                       np.indices((I,Nd))[0],np.indices((I,Nd,Nr))[0])
+        self.w_L = self.w[firm_L]
+        self.w_P = self.w[i]
+
+    def F_P2UP_Fast(self,Data,out=None):
+
+        # Same F as F_P2UP using the incidence from CompileLayout; pass out
+        # to reuse a preallocated result vector
+        if out is None:
+            out = np.empty(self.Dim)
+        nX, nL = self.nX, self.nL
+        x = Data[:nX]
+        gam = Data[nX:nX+nL]
+        lam = Data[nX+nL:]
+
+        f = self.A_LP.dot(x)
+        d = np.sum(np.reshape(f[-self.I*self.Nd*self.Nr:],
+                              (self.I,self.Nd,self.Nr)),axis=(1,))
+
+        dcdf = self.c1_L + 2.*self.c2_L*f
+        dedf = self.ef1_L + 2.*self.ef2_L*f
+        dCdx, dEdx, lam_Path = self.A_PL.dot(np.stack([dcdf,dedf,lam],
+                                                      axis=1)).T
+        dRhodx_d = self.dDemand_dd(d).ravel()[self.ir_P]
+
+        out[:nX] = dCdx + self.w_P*dEdx + lam_Path + dRhodx_d
+        out[nX:nX+nL] = self.g1_L + 2.*self.g2_L*gam + \
+            self.w_L*(self.eg1_L + 2.*self.eg2_L*gam) - self.u_L*lam
+        out[nX+nL:] = self.u_L*gam - f
+
+        return out
+
+    def Jv(self,Data,Psi,F_Data=None):
+
+        # J(Data)*Psi from the incidence of CompileLayout without forming J
+        if not hasattr(self,'A_LP'):
+            self.CompileLayout()
+        nX, nL = self.nX, self.nL
+        Psi = Psi.reshape((Data.size,-1))
+        dx = Psi[:nX]
+        dgam = Psi[nX:nX+nL]
+        dlam = Psi[nX+nL:]
+
+        # Demand derivative (rho is linear in d)
+        df = self.A_LP.dot(dx)
+        dd = np.sum(np.reshape(df[-self.I*self.Nd*self.Nr:],
+                               (self.I,self.Nd,self.Nr,-1)),axis=(1,))
+        drhodd = self.dDemandPricedDemand_drhodd()
+        ddRho = np.einsum('irk,krn->irn',self.coeff_rho_d,dd) - \
+            drhodd[:,:,None]*dd
+
+        res = np.empty_like(Psi)
+        res[:nX] = self.A_PL.dot(2.*(self.c2_L+self.w_L*self.ef2_L)[:,None]*df +
+                                 dlam) + \
+            np.reshape(ddRho,(self.I*self.Nr,-1))[self.ir_P]
+        res[nX:nX+nL] = (2.*(self.g2_L+self.w_L*self.eg2_L))[:,None]*dgam - \
+            self.u_L[:,None]*dlam
+        res[nX+nL:] = self.u_L[:,None]*dgam - df
+
+        return res
+
     def SumLinksOnPath_Edap(self,f_IM,f_MD1,f_D1D2,f_D2R):
 
         return np.reshape(f_IM[self.ind_I,self.ind_M] +
@@ -72,4 +72,13 @@ def PrintSimResults(Options, Results, Method, Time):
         print('Step Sum: %g' % sum(steps))
     print('Min |X*|: %.3f' % np.min(np.abs(Results.TempStorage['Data'][-1])))
     print('Max |X*|: %.3f' % np.max(np.abs(Results.TempStorage['Data'][-1])))
+    Profile = getattr(Results,'Profile',None)
+    if Profile is not None:
+        print('Profile: %.3fs wall' % Profile.Total)
+        for phase, seconds, calls in Profile.Breakdown():
+            print('  %-12s %9.4fs %6.1f%% %9d calls' %
+                  (phase, seconds, 100.*seconds/max(Profile.Total,1e-12),
+                   calls))
+        if Profile.Peak is not None:
+            print('Peak Memory: %.2f MB' % (Profile.Peak/2.**20))
     print('------------------------------------------------------------------')
@@ -1,4 +1,7 @@
 
+import numpy as np
+
+
 class Initialization(object):
 
     def __init__(self,Step=0):
@@ -40,12 +43,38 @@ class Termination(object):
                 return True
         return False
 
+    def IsTerminalBatch(self,Record):
+        N = Record.TempStorage['Data'][-1].shape[0]
+        if Record.thisPermIndex >= self.Tols[0]:
+            if self.verbose:
+                print('\nIteration limit met.')
+            return np.ones(N,dtype=bool)
+        done = np.zeros(N,dtype=bool)
+        for tol in self.Tols[1]:
+            if tol[0] in Record.TempStorage:
+                vals = Record.TempStorage[tol[0]][-1]
+            else:
+                vals = Record.PermStorage[tol[0]][Record.thisPermIndex]
+            done |= np.ravel(vals) <= tol[1]
+        if self.verbose and np.all(done):
+            print('\nTerminal conditions met for all %d trajectories.' % N)
+        return done
+
 
 class Reporting(object):
 
-    def __init__(self,Requests=[],Interval=1):
+    def __init__(self,Requests=[],Interval=1,Prealloc=False,Sink=None,
+                 Flush=1000,Workers=0,Executor='thread'):
         self.PermRequests = Requests
         self.Interval = Interval
+        self.Prealloc = Prealloc
+        # Directory to stream PermStorage to, flushed every Flush records
+        self.Sink = Sink
+        self.Flush = Flush
+        # Evaluate requests not used in Termination on a 'thread' or
+        # 'process' pool of Workers instead of inline
+        self.Workers = Workers
+        self.Executor = Executor
 
     def CheckRequests(self,Method,Domain):
         for req in self.PermRequests:
@@ -64,9 +93,13 @@ class Reporting(object):
 
 class Miscellaneous(object):
 
-    def __init__(self,Min=None,Timer=True):
+    def __init__(self,Min=None,Timer=True,Profile=False,Memory=False):
         self.Min = Min
         self.Timer = Timer
+        # Break Solve's wall time down by phase (F, projection, update,
+        # bookkeeping, requests, termination), plus peak traced memory
+        self.Profile = Profile
+        self.Memory = Memory
 
 
 class DescentOptions(object):
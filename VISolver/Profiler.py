@@ -0,0 +1,110 @@
+import time
+import tracemalloc
+from collections import OrderedDict
+
+
+class Timed(object):
+
+    # Stands in for a function while profiling. Compares and hashes like the
+    # function it wraps so TempStorage/PermStorage keys are unaffected.
+    def __init__(self,Profile,Name,fn):
+        self.Profile = Profile
+        self.Name = Name
+        self.fn = fn
+        self.__name__ = getattr(fn,'__name__',Name)
+        self.__func__ = getattr(fn,'__func__',fn)
+
+    def __call__(self,*args,**kwargs):
+        return self.Profile.Call(self.Name,self.fn,args,kwargs)
+
+    def __eq__(self,other):
+        if isinstance(other,Timed):
+            other = other.fn
+        return self.fn == other
+
+    def __ne__(self,other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.fn)
+
+
+class Profiler(object):
+
+    # Wall time and call counts for the hot paths of Solve. Times are self
+    # times: F and P calls made inside Method.Update are not counted again
+    # under 'Update', nor request evaluations under 'BookKeeping'.
+    Phases = ['F','P','Update','BookKeeping','Requests','IsTerminal']
+
+    def __init__(self,Memory=False):
+        self.Memory = Memory
+        self.Times = OrderedDict((name,0.) for name in self.Phases)
+        self.Calls = OrderedDict((name,0) for name in self.Phases)
+        self.Total = 0.
+        self.Peak = None
+        self.Child = []
+        self.Patched = []
+
+    def Call(self,Name,fn,args,kwargs):
+        self.Child.append(0.)
+        tic = time.perf_counter()
+        try:
+            return fn(*args,**kwargs)
+        finally:
+            dt = time.perf_counter() - tic
+            self.Times[Name] += dt - self.Child.pop()
+            self.Calls[Name] += 1
+            if self.Child:
+                self.Child[-1] += dt
+
+    def Patch(self,obj,attr,Name):
+        fn = getattr(obj,attr)
+        if isinstance(fn,Timed):
+            return
+        self.Patched.append((obj,attr,attr in vars(obj),fn))
+        setattr(obj,attr,Timed(self,Name,fn))
+
+    def Attach(self,Method,Record,Options):
+        # Wrappers go on the instances only and are removed by Detach
+        Solvers = [Method]
+        while hasattr(Solvers[-1],'Base'):
+            Solvers.append(Solvers[-1].Base)
+        for solver in Solvers:
+            if hasattr(solver,'F'):
+                self.Patch(solver,'F','F')
+            if hasattr(solver,'Proj'):
+                self.Patch(solver.Proj,'P','P')
+        self.Patch(Method,'Update','Update')
+        self.Patch(Record,'BookKeeping','BookKeeping')
+        self.Patch(Record,'Evaluate','Requests')
+        self.Patch(Options.Term,'IsTerminal','IsTerminal')
+        self.Patch(Options.Term,'IsTerminalBatch','IsTerminal')
+
+        if self.Memory:
+            self.Tracing = tracemalloc.is_tracing()
+            if not self.Tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self.tic = time.perf_counter()
+        return self
+
+    def Detach(self):
+        self.Total += time.perf_counter() - self.tic
+        if self.Memory:
+            self.Peak = tracemalloc.get_traced_memory()[1]
+            if not self.Tracing:
+                tracemalloc.stop()
+        for obj,attr,own,fn in reversed(self.Patched):
+            if own:
+                setattr(obj,attr,fn)
+            else:
+                delattr(obj,attr)
+        self.Patched = []
+
+    def Breakdown(self):
+        '''Returns (phase, seconds, calls) rows, with time not spent in
+        any tracked phase reported as 'Other'.'''
+        rows = [(name,self.Times[name],self.Calls[name])
+                for name in self.Phases]
+        rows.append(('Other',self.Total-sum(self.Times.values()),0))
+        return rows
@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.linalg import qr, qr_delete, qr_insert, solve_triangular
 
 from VISolver.Utilities import MachineLimit_Exp
 
@@ -26,15 +27,30 @@ class EntropicProjection(Projection):
 
 class EuclideanSimplexProjection(Projection):
 
+    # method='sort' is O(n log n); 'pivot' is the expected O(n) randomized
+    # pivot search from Duchi et al. (2008). Arrays with ndim > 1 are
+    # projected row by row (last axis) in one vectorized pass. Pivots come
+    # from a private RandomState so seeded runs keep the global stream.
+    def __init__(self,method='sort',seed=None):
+        assert method in ['sort','pivot']
+        self.method = method
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+
     # Taken from: https://gist.github.com/daien/1272551
     def P(self,Data,Step=0.,Direc=0.,s=1):
-        assert s > 0, "Radius s must be strictly positive (%d <= 0)" % s
+        assert np.all(np.asarray(s) > 0), "Radius s must be strictly positive"
         Data = Data + Step*Direc
+        if Data.ndim > 1:
+            return SimplexProjectRows(Data,s)
         n, = Data.shape  # will raise ValueError if Data is not 1-D
         # check if we are already on the simplex
-        if Data.sum() == s and np.alltrue(Data >= 0):
+        if Data.sum() == s and np.all(Data >= 0):
             # best projection: itself!
             return Data
+        if self.method == 'pivot':
+            theta = SimplexThresholdPivot(Data,s,self.rng)
+            return (Data - theta).clip(min=0)
         # get the array of cumulative sums of sorted (decreasing) copy of Data
         u = np.sort(Data)[::-1]
         cssd = np.cumsum(u)
@@ -47,6 +63,48 @@ class EuclideanSimplexProjection(Projection):
         return w
 
 
+class L1BallProjection(EuclideanSimplexProjection):
+
+    def P(self,Data,Step=0.,Direc=0.,s=1):
+        Data = Data + Step*Direc
+        inside = np.sum(np.abs(Data),axis=-1,keepdims=True) <= s
+        Proj = EuclideanSimplexProjection.P(self,np.abs(Data),s=s)
+        return np.where(inside,Data,np.sign(Data)*Proj)
+
+
+def SimplexThresholdPivot(v,s=1,rng=np.random):
+    # Find theta s.t. sum(max(v-theta,0)) = s by randomized pivoting
+    U = v
+    css = 0.
+    rho = 0
+    while U.size > 0:
+        k = rng.randint(U.size)
+        G = U >= U[k]
+        dcss = U[G].sum()
+        drho = np.count_nonzero(G)
+        if css + dcss - (rho + drho)*U[k] < s:
+            css += dcss
+            rho += drho
+            U = U[~G]
+        else:
+            G[k] = False
+            U = U[G]
+    return (css - s)/rho
+
+
+def SimplexProjectRows(Data,s=1):
+    # Sort-based projection of every row of Data onto the simplex
+    shape = Data.shape
+    V = Data.reshape((-1,shape[-1]))
+    n = V.shape[1]
+    u = -np.sort(-V,axis=1)
+    cssd = np.cumsum(u,axis=1) - np.reshape(s,(-1,1))
+    pos = u*np.arange(1,n+1) > cssd
+    rho = n - 1 - np.argmax(pos[:,::-1],axis=1)
+    theta = cssd[np.arange(V.shape[0]),rho]/(rho+1.)
+    return np.maximum(V - theta[:,None],0).reshape(shape)
+
+
 class NormBallProjection(Projection):
 
     def __init__(self,p=2,axis=None):
@@ -70,79 +128,216 @@ class BoxProjection(Projection):
 
 class HyperplaneProjection(Projection):
 
-    def __init__(self,hyperplanes,sequence='random'):
+    # Each hyperplane (column span of hyp) is kept as a thin orthonormal
+    # basis Q, so projecting is Q(Q^T x); all Q's are also stacked so the
+    # 'distal' residuals ||x||^2 - ||Q^T x||^2 come from one product.
+    # 'random' draws from its own RandomState, not the global stream.
+    def __init__(self,hyperplanes,sequence='random',seed=None):
         assert sequence in ['random','cyclic','distal']
         self.hyps = hyperplanes
-        self.ps = []
-        for hyp in self.hyps:
-            scale = np.linalg.inv(hyp.T.dot(hyp))
-            p = hyp.dot(scale).dot(hyp.T)
-            self.ps += [p]
+        self.Qs = [np.linalg.qr(hyp)[0] for hyp in self.hyps]
+        self.Q_all = np.hstack(self.Qs)
+        self.splits = np.cumsum([0]+[Q.shape[1] for Q in self.Qs[:-1]])
         self.seq = sequence
         self.idx = 0
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
 
     def P(self,Data,Step=0.,Direc=0.):
         _Data = Data+Step*Direc
         if self.seq == 'random':
-            p = self.ps[np.random.randint(len(self.ps))]
-            return p.dot(_Data)
+            Q = self.Qs[self.rng.randint(len(self.Qs))]
+            return Q.dot(Q.T.dot(_Data))
         elif self.seq == 'cyclic':
-            p = self.ps[self.idx]
+            Q = self.Qs[self.idx]
             self.idx = (self.idx + 1) % len(self.hyps)
-            return p.dot(_Data)
+            return Q.dot(Q.T.dot(_Data))
         elif self.seq == 'distal':
-            e = self.errors(_Data)
-            return _Data - e[np.argmax(np.linalg.norm(e,axis=1))]
+            coeffs = self.Q_all.T.dot(_Data)
+            i = np.argmin(np.add.reduceat(coeffs**2,self.splits))
+            j = self.splits[i]
+            return self.Qs[i].dot(coeffs[j:j+self.Qs[i].shape[1]])
         else:
             raise NotImplementedError('Sequence option does not exist.')
 
     def errors(self,Data):
-        return [Data - p.dot(Data) for p in self.ps]
+        coeffs = np.split(self.Q_all.T.dot(Data),self.splits[1:])
+        return np.array([Data - Q.dot(c) for Q,c in zip(self.Qs,coeffs)])
 
 
 class PolytopeProjection(Projection):
 
-    # http://cvxopt.org/userguide/coneprog.html#quadratic-programming
     # This function projects onto the polytope using L2 distance
     # Let x_k = Data + Step * Direc
     # min_x ||x-x_k||^2 s.t. Gx<=h, Ax=b
-    def __init__(self,G=None,h=None,A=None,b=None):
-        try:
-            from cvxopt import solvers
-            solvers.options['show_progress'] = False
-            from cvxopt import matrix
-        except ImportError:
-            self.qp = None
-            self.matrix = None
-            raise ImportError('CVXOPT required for '+self.__class__.__name__)
-        else:
-            self.qp = solvers.qp
-            self.matrix = matrix
+    # engine='active' (default) uses the Goldfarb-Idnani dual active-set
+    # method with identity Hessian. The QR factors of the active constraint
+    # normals are updated in place as constraints enter/leave and are kept
+    # between calls, so each projection warm-starts from the last active set.
+    # engine='cvxopt' solves the primal QP with cvxopt instead:
+    # http://cvxopt.org/userguide/coneprog.html#quadratic-programming
+    def __init__(self,G=None,h=None,A=None,b=None,engine='active',tol=1e-10,
+                 MaxIter=None):
+        assert engine in ['active','cvxopt']
+        self.engine = engine
         self.G = self.h = self.A = self.b = None
         if (G is not None) and (h is not None):
-            self.G = self.matrix(G,tc='d')
-            self.h = self.matrix(h,tc='d')
+            self.G = np.atleast_2d(np.asarray(G,dtype=float))
+            self.h = np.atleast_1d(np.asarray(h,dtype=float))
             self.case = 1
         if (A is not None) and (b is not None):
-            self.A = self.matrix(A,tc='d')
-            self.b = self.matrix(b,tc='d')
+            self.A = np.atleast_2d(np.asarray(A,dtype=float))
+            self.b = np.atleast_1d(np.asarray(b,dtype=float))
             self.case = 2
         if (self.G is not None) and (self.A is not None):
             self.case = 3
         if (self.G is None) and (self.A is None):
             err = 'G & h and/or A & b should be specified as numpy arrays'
             raise TypeError(err)
+        self.tol = tol
+        self.MaxIter = MaxIter
+
+        self.qp = None
+        if engine == 'cvxopt':
+            self.LoadCVXOPT()
+        else:
+            self.Factorize()
+
+    def Factorize(self):
+        # Constraints as N[:,j]^T x >= c[j]: independent rows of A first
+        # (always active), then -G
+        n = (self.A if self.G is None else self.G).shape[1]
+        N, c = [np.zeros((n,0))], [np.zeros(0)]
+        self.nEq = 0
+        if self.A is not None:
+            _, R, piv = qr(self.A.T,mode='economic',pivoting=True)
+            d = np.abs(np.diag(R))
+            rank = int(np.sum(d > self.tol*max(1.,d.max())))
+            keep = np.sort(piv[:rank])
+            N.append(self.A[keep].T)
+            c.append(self.b[keep])
+            self.nEq = rank
+        if self.G is not None:
+            N.append(-self.G.T)
+            c.append(-self.h)
+        self.N = np.hstack(N)
+        self.c = np.concatenate(c)
+        if self.MaxIter is None:
+            self.MaxIter = 10*self.N.shape[1]+10
+        self.act = list(range(self.nEq))
+        if self.nEq > 0:
+            self.Q, self.R = np.linalg.qr(self.N[:,:self.nEq])
+        else:
+            self.Q, self.R = np.zeros((n,0)), np.zeros((0,0))
+
+    def LoadCVXOPT(self):
+        try:
+            from cvxopt import solvers
+            solvers.options['show_progress'] = False
+            from cvxopt import matrix
+        except ImportError:
+            raise ImportError('CVXOPT required for '+self.__class__.__name__+
+                              " with engine='cvxopt'")
+        self.qp = solvers.qp
+        self.matrix = matrix
 
     def P(self,Data,Step=0.,Direc=0.):
+        if self.engine == 'cvxopt':
+            return self.P_cvxopt(Data,Step,Direc)
+        y = np.ravel(Data+Step*Direc).astype(float)
+        return np.reshape(self.Project(y),np.shape(Data))
+
+    def Project(self,y):
+        N, c, nEq = self.N, self.c, self.nEq
+        tol = self.tol*(1.+np.max(np.abs(c),initial=0.))
+
+        # Warm start: optimum on the previous active set, dropping
+        # inequalities whose multipliers have turned negative
+        while True:
+            u = self.Multipliers(y)
+            x = y + N[:,self.act].dot(u)
+            if len(u) == nEq or np.min(u[nEq:]) >= 0:
+                break
+            self.Drop(nEq+np.argmin(u[nEq:]))
+
+        # Add the most violated inequality until none remain
+        for it in range(self.MaxIter):
+            s = N[:,nEq:].T.dot(x) - c[nEq:]
+            if s.size == 0 or np.min(s) >= -tol:
+                return x
+            p = nEq+np.argmin(s)
+            n_p = N[:,p]
+            u_p = 0.
+            while True:
+                # Primal step direction z and multiplier change r
+                w = self.Q.T.dot(n_p)
+                z = n_p - self.Q.dot(w)
+                r = solve_triangular(self.R,w) if len(w) else w
+                # Partial step: largest step keeping active multipliers >= 0
+                t1, k = np.inf, None
+                blocking = np.nonzero(r[nEq:] > 0)[0] + nEq
+                if blocking.size:
+                    ratios = u[blocking]/r[blocking]
+                    k = blocking[np.argmin(ratios)]
+                    t1 = np.min(ratios)
+                # Full step: makes constraint p active
+                t2 = np.inf
+                zn = z.dot(n_p)
+                if zn > 1e-12*n_p.dot(n_p):
+                    t2 = (c[p]-n_p.dot(x))/zn
+                if np.isinf(t1) and np.isinf(t2):
+                    raise ValueError('Polytope is empty.')
+                t = min(t1,t2)
+                if not np.isinf(t2):
+                    x = x + t*z
+                u = u - t*r
+                u_p += t
+                if t == t2:
+                    self.Add(p)
+                    u = np.append(u,u_p)
+                    break
+                u = np.delete(u,k)
+                self.Drop(k)
+        print('PolytopeProjection: MaxIter reached.')
+        return x
+
+    def Multipliers(self,y):
+        if not self.act:
+            return np.zeros(0)
+        rhs = self.c[self.act] - self.N[:,self.act].T.dot(y)
+        return solve_triangular(self.R,solve_triangular(self.R,rhs,trans='T'))
+
+    def Add(self,j):
+        col = self.N[:,j]
+        if self.act:
+            self.Q, self.R = qr_insert(self.Q,self.R,col,len(self.act),
+                                       which='col')
+        else:
+            nrm = np.linalg.norm(col)
+            self.Q, self.R = (col/nrm)[:,None], np.array([[nrm]])
+        self.act.append(j)
+
+    def Drop(self,k):
+        Q, R = qr_delete(self.Q,self.R,k,which='col')
+        # a square Q is treated as a full factorization - trim it back
+        m = R.shape[1]
+        self.Q, self.R = Q[:,:m], R[:m]
+        del self.act[k]
+
+    def P_cvxopt(self,Data,Step=0.,Direc=0.):
+        if self.qp is None:
+            self.LoadCVXOPT()
         P = self.matrix(2.*np.identity(len(Data)),tc='d')
         q = self.matrix(-2.*(Data+Step*Direc),tc='d')
+        G, h, A, b = [None if X is None else self.matrix(X,tc='d')
+                      for X in [self.G,self.h,self.A,self.b]]
         # cvx quad prog solver returns a matrix object, not numpy array
         if self.case == 1:
-            NewData = self.qp(P,q,G=self.G,h=self.h)['x']
+            NewData = self.qp(P,q,G=G,h=h)['x']
         elif self.case == 2:
-            NewData = self.qp(P,q,A=self.A,b=self.b)['x']
+            NewData = self.qp(P,q,A=A,b=b)['x']
         elif self.case == 3:
-            NewData = self.qp(P,q,self.G,self.h,self.A,self.b)['x']
+            NewData = self.qp(P,q,G,h,A,b)['x']
         else:
             raise NotImplementedError('Unexpected error: no match for case!')
         return np.reshape(NewData,Data.shape)
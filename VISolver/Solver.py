@@ -1,5 +1,8 @@
 
-from VISolver.Storage import Storage
+import numpy as np
+
+from VISolver.Profiler import Profiler
+from VISolver.Storage import Storage, RingBuffer
 
 
 class Solver(object):
@@ -22,7 +25,8 @@ class Solver(object):
     def BookKeeping(self,TempData):
 
         for item in self.TempStorage:
-            self.TempStorage[item].pop(0)
+            if not isinstance(self.TempStorage[item],RingBuffer):
+                self.TempStorage[item] = RingBuffer(self.TempStorage[item])
             self.TempStorage[item].append(TempData[item])
 
     def Update(self,Record):
@@ -38,6 +42,20 @@ class Solver(object):
         return self.TempStorage
 
 
+def RejectSteps(Method,TempData,Accept,Data,NewData,Err):
+    # Record step control state; rejected steps (or rows of a batch) stay
+    # at Data, and if every step is rejected F(Data) is reused
+    TempData['Error'] = Err
+    TempData['Rejections'] = np.sum(~Accept) + \
+        Method.TempStorage['Rejections'][-1]
+    if np.all(Accept):
+        return NewData
+    if not np.any(Accept):
+        TempData[Method.F] = Method.TempStorage[Method.F][-1]
+        return Data
+    return np.where(Accept,NewData,Data)
+
+
 def Solve(Start,Method,Domain,Options):
 
     #Record Data Dimension
@@ -49,6 +67,11 @@ def Solve(Start,Method,Domain,Options):
     #Create Storage Object for Record Keeping
     Record = Storage(Start,Domain,Method,Options)
 
+    #Time Hot Paths if Requested
+    if Options.Misc.Profile:
+        Record.Profile = Profiler(Options.Misc.Memory).Attach(Method,Record,
+                                                              Options)
+
     #Begin Solving
     while not Options.Term.IsTerminal(Record):
 
@@ -60,6 +83,61 @@ def Solve(Start,Method,Domain,Options):
             Record.BookKeeping(TempStorage)
         except Exception as e:
             print(e)
+            Record.Finalize()
+            return Record
+
+    Record.Finalize()
+    return Record
+
+
+def SolveBatch(Starts,Method,Domain,Options):
+    '''Solves from many start points at once.
+
+    Starts is an (N,Dim) array whose rows are advanced together, so
+    Domain.F must accept an (N,Dim) array and return F row by row. Adaptive
+    methods (HeunEuler, CashKarp) keep one step size per row. Rows that meet
+    a terminal condition are frozen by zeroing their step.'''
+
+    Starts = np.atleast_2d(Starts)
+
+    #Record Data Dimension
+    Domain.Dim = Starts.shape[1]
+
+    #Check Validity of Options
+    Options.CheckOptions(Method,Domain)
+
+    #Create Storage Object for Record Keeping
+    Record = Storage(Starts,Domain,Method,Options)
+
+    #Time Hot Paths if Requested
+    if Options.Misc.Profile:
+        Record.Profile = Profiler(Options.Misc.Memory).Attach(Method,Record,
+                                                              Options)
+
+    #Give Each Trajectory Its Own Step
+    Steps = Record.TempStorage['Step']
+    Steps[-1] = Steps[-1]*np.ones((Starts.shape[0],1))
+
+    #Begin Solving
+    Done = Options.Term.IsTerminalBatch(Record)
+    while not np.all(Done):
+
+        #Freeze Terminated Trajectories
+        Steps = Record.TempStorage['Step']
+        Steps[-1] = np.where(Done[:,None],0.,Steps[-1])
+
+        try:
+            #Compute New Data Using Update Method
+            TempStorage = Method.Update(Record)
+
+            #Record Update Stats
+            Record.BookKeeping(TempStorage)
+        except Exception as e:
+            print(e)
+            Record.Finalize()
             return Record
 
+        Done = Options.Term.IsTerminalBatch(Record) | Done
+
+    Record.Finalize()
     return Record
@@ -1,13 +1,14 @@
 import numpy as np
 
 from VISolver.Projection import IdentityProjection
-from VISolver.Solver import Solver
+from VISolver.Solver import Solver, RejectSteps
 
 
 class ABEuler(Solver):
 
     def __init__(self, Domain, P=IdentityProjection(), Delta0=1e-2,
-                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10):
+                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10,
+                 Control=None):
 
         self.F = Domain.F
 
@@ -25,6 +26,8 @@ class ABEuler(Solver):
 
         self.MaxStep = MaxStep
 
+        self.Control = Control
+
     def InitTempStorage(self,Start,Domain,Options):
 
         self.TempStorage['Data'] = self.StorageSize*[Start]
@@ -32,6 +35,9 @@ class ABEuler(Solver):
         self.TempStorage['Step'] = self.StorageSize*[Options.Init.Step]
         self.TempStorage['F Evaluations'] = self.StorageSize*[1]
         self.TempStorage['Projections'] = self.StorageSize*[0]
+        if self.Control is not None:
+            self.TempStorage['Error'] = self.StorageSize*[1.]
+            self.TempStorage['Rejections'] = self.StorageSize*[0]
 
         return self.TempStorage
 
@@ -54,6 +60,9 @@ class ABEuler(Solver):
 
             # Record Projections
             TempData['Projections'] = 1 + self.TempStorage['Projections'][-1]
+            if self.Control is not None:
+                TempData['Error'] = self.TempStorage['Error'][-1]
+                TempData['Rejections'] = self.TempStorage['Rejections'][-1]
 
         else:
 
@@ -65,11 +74,16 @@ class ABEuler(Solver):
             _NewData = self.Proj.P(Data,Step,Fs[-1])
 
             # Adjust Stepsize
-            Delta = max(abs(NewData-_NewData))
-            if Delta == 0:
-                growth = self.GrowthLimit
+            if self.Control is None:
+                Delta = max(abs(NewData-_NewData))
+                if Delta == 0:
+                    growth = self.GrowthLimit
+                else:
+                    growth = min((self.Delta0/Delta)**0.5, self.GrowthLimit)
             else:
-                growth = min((self.Delta0/Delta)**0.5, self.GrowthLimit)
+                Accept, growth, Err = self.Control.Adjust(
+                    Data,NewData,_NewData,self.TempStorage['Error'][-1],2)
+                NewData = RejectSteps(self,TempData,Accept,Data,NewData,Err)
             Step = np.clip(growth*Step,self.MinStep,self.MaxStep)
 
             # Record Projections
@@ -77,8 +91,13 @@ class ABEuler(Solver):
 
         # Store Data
         TempData['Data'] = NewData
-        TempData[self.F] = self.F(NewData)
+        if self.F in TempData:  # step rejected, F(Data) is reused
+            Evals = 0
+        else:
+            TempData[self.F] = self.F(NewData)
+            Evals = 1
         TempData['Step'] = Step
-        TempData['F Evaluations'] = 1 + self.TempStorage['F Evaluations'][-1]
+        TempData['F Evaluations'] = Evals + \
+            self.TempStorage['F Evaluations'][-1]
         self.BookKeeping(TempData)
         return self.TempStorage
@@ -1,18 +1,24 @@
+from functools import partial
+
 import numpy as np
 
 from VISolver.Projection import IdentityProjection
 from VISolver.Solver import Solver
-from VISolver.Utilities import GramSchmidt
+from VISolver.Utilities import OrthonormalizeQR, ReorthoDue, Jv
 
 
 class ABEuler_LEGS(Solver):
 
     def __init__(self, Domain, P=IdentityProjection(), Delta0=1e-2,
-                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10):
+                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10,
+                 ReorthoEvery=1, ReorthoCond=None):
 
         self.F = Domain.F
 
-        self.Jac = Domain.Jac
+        if hasattr(Domain,'Jv'):
+            self.Jv = Domain.Jv
+        else:
+            self.Jv = partial(Jv,Jac=Domain.Jac)
 
         self.Proj = P
 
@@ -28,17 +34,22 @@ class ABEuler_LEGS(Solver):
 
         self.MaxStep = MaxStep
 
+        self.ReorthoEvery = ReorthoEvery
+
+        self.ReorthoCond = ReorthoCond
+
     def InitTempStorage(self,Start,Domain,Options):
 
         self.TempStorage['Data'] = self.StorageSize*[Start]
         self.TempStorage[self.F] = self.StorageSize*[self.F(Start)]
 
         Psi_0 = np.eye(Start.size)
-        dPsi_0 = np.dot(self.Jac(Start),Psi_0)
+        dPsi_0 = self.Jv(Start,Psi_0,F_Data=self.TempStorage[self.F][-1])
         self.TempStorage['Psi'] = self.StorageSize*[Psi_0.flatten()]
         self.TempStorage['dPsi'] = self.StorageSize*[dPsi_0.flatten()]
         self.TempStorage['Lyapunov'] = self.StorageSize*[0*Start]
         self.TempStorage['T'] = self.StorageSize*[0]
+        self.TempStorage['T_QR'] = self.StorageSize*[0]
 
         self.TempStorage['Step'] = self.StorageSize*[Options.Init.Step]
         self.TempStorage['F Evaluations'] = self.StorageSize*[1]
@@ -55,6 +66,7 @@ class ABEuler_LEGS(Solver):
         Data_psi = Record.TempStorage['Psi'][-1]
         Lyapunov = Record.TempStorage['Lyapunov'][-1]
         T = Record.TempStorage['T'][-1]
+        T_QR = Record.TempStorage['T_QR'][-1]
         dim = Data_x.size
 
         Step = Record.TempStorage['Step'][-1]
@@ -70,13 +82,16 @@ class ABEuler_LEGS(Solver):
             NewData_x = self.Proj.P(Data_x,Step,F_x)
             NewData_psi = Data_psi+Step*F_psi
 
-            # Orthogonalize Psi, Record Lyapunov Exponents, Normalize Psi
+            # Orthonormalize Psi (QR), Record Lyapunov Exponents
             NewData_psi = NewData_psi.reshape((dim,-1))
-            NewData_psi = GramSchmidt(NewData_psi,normalize=False)
-            LEDT = np.log(np.linalg.norm(NewData_psi,axis=0))
             Tnew = T + abs(Step)
-            NewLyapunov = (Lyapunov*T+LEDT)/Tnew
-            NewData_psi = NewData_psi/np.linalg.norm(NewData_psi,axis=0)
+            if ReorthoDue(NewData_psi,Record.thisPermIndex,
+                          self.ReorthoEvery,self.ReorthoCond):
+                NewData_psi, LEDT = OrthonormalizeQR(NewData_psi)
+                NewLyapunov = (Lyapunov*T_QR+LEDT)/Tnew
+                T_QR = Tnew
+            else:
+                NewLyapunov = Lyapunov
 
             # Record Projections
             TempData['Projections'] = 1 + self.TempStorage['Projections'][-1]
@@ -97,13 +112,16 @@ class ABEuler_LEGS(Solver):
             Delta_x = max(abs(NewData_x-_NewData_x))
             Delta_psi = max(abs(NewData_psi-_NewData_psi))
 
-            # Orthogonalize Psi, Record Lyapunov Exponents, Normalize Psi
+            # Orthonormalize Psi (QR), Record Lyapunov Exponents
             NewData_psi = NewData_psi.reshape((dim,-1))
-            NewData_psi = GramSchmidt(NewData_psi,normalize=False)
-            LEDT = np.log(np.linalg.norm(NewData_psi,axis=0))
             Tnew = T + abs(Step)
-            NewLyapunov = (Lyapunov*T+LEDT)/Tnew
-            NewData_psi = NewData_psi/np.linalg.norm(NewData_psi,axis=0)
+            if ReorthoDue(NewData_psi,Record.thisPermIndex,
+                          self.ReorthoEvery,self.ReorthoCond):
+                NewData_psi, LEDT = OrthonormalizeQR(NewData_psi)
+                NewLyapunov = (Lyapunov*T_QR+LEDT)/Tnew
+                T_QR = Tnew
+            else:
+                NewLyapunov = Lyapunov
 
             # Adjust Stepsize
             Delta = max(Delta_x,Delta_psi)
@@ -120,9 +138,10 @@ class ABEuler_LEGS(Solver):
         TempData['Data'] = NewData_x
         TempData[self.F] = self.F(NewData_x)
         TempData['Psi'] = NewData_psi.flatten()
-        TempData['dPsi'] = np.dot(self.Jac(NewData_x),NewData_psi).flatten()
+        TempData['dPsi'] = self.Jv(NewData_x,NewData_psi,F_Data=TempData[self.F]).flatten()
         TempData['Lyapunov'] = NewLyapunov
         TempData['T'] = Tnew
+        TempData['T_QR'] = T_QR
         TempData['Step'] = Step
         TempData['F Evaluations'] = 1 + self.TempStorage['F Evaluations'][-1]
         self.BookKeeping(TempData)
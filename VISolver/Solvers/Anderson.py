@@ -0,0 +1,117 @@
+import numpy as np
+
+from VISolver.Solver import Solver
+
+
+class Anderson(Solver):
+
+    # Anderson acceleration (type II, Walker & Ni 2011) of any base method,
+    # treating one Base.Update as the fixed point map x -> G(x), e.g.
+    # Anderson(Euler(Domain,P,FixStep=True)) or Anderson(EG(Domain,P)).
+    # The last m differences of G(x) and of the residual G(x)-x are kept in
+    # circular (m,Dim) buffers. If an accelerated point leaves the residual
+    # more than a factor Safeguard above the best seen so far, it is thrown
+    # out in favor of the plain G(x) it replaced and the memory is cleared.
+    def __init__(self,Base,m=5,Beta=1.,Safeguard=1.,Reg=1e-2):
+
+        self.Base = Base
+
+        self.F = Base.F
+
+        self.Proj = Base.Proj
+
+        self.StorageSize = Base.StorageSize
+
+        self.m = m
+
+        self.Beta = Beta
+
+        self.Safeguard = Safeguard
+
+        self.Reg = Reg
+
+        self.TempStorage = Base.TempStorage
+
+    def InitTempStorage(self,Start,Domain,Options):
+
+        self.TempStorage = self.Base.InitTempStorage(Start,Domain,Options)
+
+        self.dG = np.zeros((self.m,Start.size))
+        self.dR = np.zeros((self.m,Start.size))
+        self.head = 0
+        self.count = 0
+        self.G = None
+        self.R = None
+        self.RMin = np.inf
+        self.Accelerated = False
+        self.Restarts = 0
+
+        return self.TempStorage
+
+    def Restart(self):
+        self.head = 0
+        self.count = 0
+        self.Restarts += 1
+
+    def Update(self,Record):
+
+        # Retrieve Necessary Data
+        Data = Record.TempStorage['Data'][-1]
+
+        # One step of the base method is one application of G
+        TempStorage = self.Base.Update(Record)
+        G = TempStorage['Data'][-1]
+        R = (G-Data).ravel()
+
+        # Safeguard: the accelerated point made things worse, so discard it
+        # and fall back to the plain G from the previous step
+        if self.Accelerated and np.dot(R,R) > self.Safeguard**2*self.RMin:
+            self.Restart()
+            NewData = self.G.reshape(G.shape)
+            self.G = None
+            self.R = None
+            self.Accelerated = False
+            return self.Swap(TempStorage,NewData,0)
+
+        if self.R is not None:
+            self.dG[self.head] = G.ravel()-self.G
+            self.dR[self.head] = R-self.R
+            self.head = (self.head+1) % self.m
+            self.count = min(self.count+1,self.m)
+        self.G = G.ravel().copy()
+        self.R = R
+        self.RMin = min(self.RMin,np.dot(R,R))
+        self.Accelerated = False
+
+        if self.count == 0:
+            return TempStorage
+
+        # gamma = argmin |R - dR^T gamma|^2 + Reg*|R|^2*|gamma|^2; the
+        # ridge term damps gamma when dR is small next to R (e.g. while
+        # still drifting far from the solution), rows in any order
+        dG = self.dG[:self.count]
+        dR = self.dR[:self.count]
+        A = np.dot(dR,dR.T)
+        A[np.diag_indices_from(A)] += self.Reg*np.dot(R,R)
+        try:
+            gamma = np.linalg.solve(A,np.dot(dR,R))
+        except np.linalg.LinAlgError:
+            self.Restart()
+            return TempStorage
+
+        NewData = G.ravel() - np.dot(gamma,dG)
+        if self.Beta != 1.:
+            NewData -= (1.-self.Beta)*(R-np.dot(gamma,dR))
+        NewData = self.Proj.P(NewData.reshape(G.shape))
+        self.Accelerated = True
+
+        return self.Swap(TempStorage,NewData)
+
+    def Swap(self,TempStorage,NewData,Projections=1):
+        # Put NewData in place of the base method's latest iterate
+        TempStorage['Data'][-1] = NewData
+        TempStorage[self.F][-1] = self.F(NewData)
+        TempStorage['F Evaluations'][-1] += 1
+        TempStorage['Projections'][-1] += Projections
+
+        return TempStorage
@@ -1,13 +1,13 @@
 import numpy as np
 
 from VISolver.Projection import IdentityProjection
-from VISolver.Solver import Solver
+from VISolver.Solver import Solver, RejectSteps
 
 
 class CashKarp(Solver):
 
     def __init__(self, Domain, P=IdentityProjection(), Delta0=1e-4,
-                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10):
+                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10, Control=None):
 
         self.F = Domain.F
 
@@ -25,6 +25,8 @@ class CashKarp(Solver):
 
         self.MaxStep = MaxStep
 
+        self.Control = Control
+
         self.BT = np.array([
             [1./5.,0.,0.,0.,0.,0.],
             [3./40.,9./40.,0.,0.,0.,0.],
@@ -42,6 +44,9 @@ class CashKarp(Solver):
         self.TempStorage['Step'] = self.StorageSize*[Options.Init.Step]
         self.TempStorage['F Evaluations'] = self.StorageSize*[1]
         self.TempStorage['Projections'] = self.StorageSize*[0]
+        if self.Control is not None:
+            self.TempStorage['Error'] = self.StorageSize*[1.]
+            self.TempStorage['Rejections'] = self.StorageSize*[0]
 
         return self.TempStorage
 
@@ -51,8 +56,8 @@ class CashKarp(Solver):
 
         # Retrieve Necessary Data
         Data = Record.TempStorage['Data'][-1]
-        Fs = np.zeros((6,Data.shape[0]),dtype=Data.dtype)
-        Fs[0,:] = Record.TempStorage[self.F][-1]
+        Fs = np.zeros((6,)+Data.shape,dtype=Data.dtype)
+        Fs[0] = Record.TempStorage[self.F][-1]
         Step = Record.TempStorage['Step'][-1]
 
         # Initialize Storage
@@ -62,7 +67,7 @@ class CashKarp(Solver):
         for i in range(5):
             direction = np.einsum('i,i...', self.BT[i,:i+1], Fs[:i+1])
             _NewData = self.Proj.P(Data, Step, direction)
-            Fs[i+1,:] = self.F(_NewData)
+            Fs[i+1] = self.F(_NewData)
 
         # Compute order-p, order-p+1 data points
         direction = np.einsum('i,i...', self.BT[6,:6], Fs[:6])
@@ -70,19 +75,29 @@ class CashKarp(Solver):
         direction = np.einsum('i,i...', self.BT[5,:6], Fs[:6])
         NewData = self.Proj.P(Data, Step, direction)
 
-        # Adjust Stepsize
-        Delta = max(abs(NewData-_NewData))
-        if Delta == 0:
-            growth = self.GrowthLimit
+        # Adjust Stepsize (one step per row if Data is an (N,Dim) batch)
+        if self.Control is None:
+            Delta = np.max(abs(NewData-_NewData),axis=-1,
+                           keepdims=Data.ndim > 1)
+            with np.errstate(divide='ignore'):
+                growth = np.minimum((self.Delta0/Delta)**0.2,
+                                    self.GrowthLimit)
         else:
-            growth = min((self.Delta0/Delta)**0.2, self.GrowthLimit)
+            Accept, growth, Err = self.Control.Adjust(
+                Data,NewData,_NewData,self.TempStorage['Error'][-1],5)
+            NewData = RejectSteps(self,TempData,Accept,Data,NewData,Err)
         Step = np.clip(growth*Step,self.MinStep,self.MaxStep)
 
         # Store Data
         TempData['Data'] = NewData
-        TempData[self.F] = self.F(NewData)
+        if self.F in TempData:  # step rejected, F(Data) is reused
+            Evals = 5
+        else:
+            TempData[self.F] = self.F(NewData)
+            Evals = 6
         TempData['Step'] = Step
-        TempData['F Evaluations'] = 6 + self.TempStorage['F Evaluations'][-1]
+        TempData['F Evaluations'] = Evals + \
+            self.TempStorage['F Evaluations'][-1]
         TempData['Projections'] = 6 + self.TempStorage['Projections'][-1]
         self.BookKeeping(TempData)
 
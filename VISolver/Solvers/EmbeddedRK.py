@@ -0,0 +1,170 @@
+import numpy as np
+
+from VISolver.Projection import IdentityProjection
+from VISolver.Solver import Solver, RejectSteps
+
+
+# Butcher tableaus for embedded pairs: stage matrix A, propagated weights b
+# (order p), embedded weights bhat, order p, and whether the last stage is
+# evaluated at the new point (first same as last)
+Tableaus = {
+    'HeunEuler': dict(
+        A=[[0.,0.],
+           [1.,0.]],
+        b=[0.5,0.5],
+        bhat=[1.,0.],
+        order=2,
+        fsal=False),
+    'BogackiShampine': dict(
+        A=[[0.,0.,0.,0.],
+           [1./2.,0.,0.,0.],
+           [0.,3./4.,0.,0.],
+           [2./9.,1./3.,4./9.,0.]],
+        b=[2./9.,1./3.,4./9.,0.],
+        bhat=[7./24.,1./4.,1./3.,1./8.],
+        order=3,
+        fsal=True),
+    'CashKarp': dict(
+        A=[[0.,0.,0.,0.,0.,0.],
+           [1./5.,0.,0.,0.,0.,0.],
+           [3./40.,9./40.,0.,0.,0.,0.],
+           [3./10.,-9./10.,6./5.,0.,0.,0.],
+           [-11./54.,5./2.,-70./27.,35./27.,0.,0.],
+           [1631./55296.,175./512.,575./13824.,44275./110592.,253./4096.,0.]],
+        b=[37./378.,0.,250./621.,125./594.,0.,512./1771.],
+        bhat=[2825./27648.,0.,18575./48384.,13525./55296.,277./14336.,0.25],
+        order=5,
+        fsal=False),
+    'DormandPrince': dict(
+        A=[[0.,0.,0.,0.,0.,0.,0.],
+           [1./5.,0.,0.,0.,0.,0.,0.],
+           [3./40.,9./40.,0.,0.,0.,0.,0.],
+           [44./45.,-56./15.,32./9.,0.,0.,0.,0.],
+           [19372./6561.,-25360./2187.,64448./6561.,-212./729.,0.,0.,0.],
+           [9017./3168.,-355./33.,46732./5247.,49./176.,-5103./18656.,0.,
+            0.],
+           [35./384.,0.,500./1113.,125./192.,-2187./6784.,11./84.,0.]],
+        b=[35./384.,0.,500./1113.,125./192.,-2187./6784.,11./84.,0.],
+        bhat=[5179./57600.,0.,7571./16695.,393./640.,-92097./339200.,
+              187./2100.,1./40.],
+        order=5,
+        fsal=True),
+}
+Tableaus['BS32'] = Tableaus['BogackiShampine']
+Tableaus['DP54'] = Tableaus['DormandPrince']
+
+
+class EmbeddedRK(Solver):
+
+    def __init__(self, Domain, P=IdentityProjection(), Tableau='DP54',
+                 Delta0=1e-4, GrowthLimit=2, MinStep=-1e10, MaxStep=1e10,
+                 Control=None):
+
+        self.F = Domain.F
+
+        self.Proj = P
+
+        self.StorageSize = 1
+
+        self.TempStorage = {}
+
+        self.Tableau = Tableau
+
+        tab = Tableaus[Tableau] if isinstance(Tableau,str) else Tableau
+        self.A = np.asarray(tab['A'],dtype=float)
+        self.b = np.asarray(tab['b'],dtype=float)
+        self.bhat = np.asarray(tab['bhat'],dtype=float)
+        self.order = tab['order']
+        self.fsal = tab['fsal']
+        self.Stages = len(self.b)
+
+        self.Delta0 = Delta0
+
+        self.GrowthLimit = GrowthLimit
+
+        self.MinStep = MinStep
+
+        self.MaxStep = MaxStep
+
+        self.Control = Control
+
+        self.Ks = None
+
+    def InitTempStorage(self,Start,Domain,Options):
+
+        self.TempStorage['Data'] = self.StorageSize*[Start]
+        self.TempStorage[self.F] = self.StorageSize*[self.F(Start)]
+        self.TempStorage['Step'] = self.StorageSize*[Options.Init.Step]
+        self.TempStorage['F Evaluations'] = self.StorageSize*[1]
+        self.TempStorage['Projections'] = self.StorageSize*[0]
+        if self.Control is not None:
+            self.TempStorage['Error'] = self.StorageSize*[1.]
+            self.TempStorage['Rejections'] = self.StorageSize*[0]
+
+        return self.TempStorage
+
+    # BookKeeping(self,TempData) defined in super class 'Solver'
+
+    def Update(self,Record):
+
+        # Retrieve Necessary Data
+        Data = Record.TempStorage['Data'][-1]
+        Step = Record.TempStorage['Step'][-1]
+
+        # Stage buffer is allocated once and reused across steps
+        shape = (self.Stages,)+Data.shape
+        if self.Ks is None or self.Ks.shape != shape:
+            self.Ks = np.zeros(shape,dtype=Data.dtype)
+        Ks = self.Ks
+        Ks[0] = Record.TempStorage[self.F][-1]
+
+        # Initialize Storage
+        TempData = {}
+
+        # Calculate stage gradients (the last stage lands on NewData if FSAL)
+        for i in range(1,self.Stages):
+            direction = np.tensordot(self.A[i,:i],Ks[:i],axes=1)
+            _Data = self.Proj.P(Data,Step,direction)
+            F_Data = self.F(_Data)
+            Ks[i] = F_Data
+
+        # Compute propagated and embedded data points
+        if self.fsal:
+            NewData = _Data
+            TempData[self.F] = F_Data
+            Projs = self.Stages
+        else:
+            NewData = self.Proj.P(Data,Step,np.tensordot(self.b,Ks,axes=1))
+            Projs = self.Stages+1
+        _NewData = self.Proj.P(Data,Step,np.tensordot(self.bhat,Ks,axes=1))
+        Evals = self.Stages-1
+
+        # Adjust Stepsize (one step per row if Data is an (N,Dim) batch)
+        if self.Control is None:
+            Delta = np.max(abs(NewData-_NewData),axis=-1,
+                           keepdims=Data.ndim > 1)
+            with np.errstate(divide='ignore'):
+                growth = np.minimum((self.Delta0/Delta)**(1./self.order),
+                                    self.GrowthLimit)
+        else:
+            Accept, growth, Err = self.Control.Adjust(
+                Data,NewData,_NewData,self.TempStorage['Error'][-1],
+                self.order)
+            if self.fsal and not np.all(Accept):
+                del TempData[self.F]
+            NewData = RejectSteps(self,TempData,Accept,Data,NewData,Err)
+        Step = np.clip(growth*Step,self.MinStep,self.MaxStep)
+
+        # Store Data
+        TempData['Data'] = NewData
+        if self.F not in TempData:
+            TempData[self.F] = self.F(NewData)
+            Evals += 1
+        TempData['Step'] = Step
+        TempData['F Evaluations'] = Evals + \
+            self.TempStorage['F Evaluations'][-1]
+        TempData['Projections'] = Projs + \
+            self.TempStorage['Projections'][-1]
+        self.BookKeeping(TempData)
+
+        return self.TempStorage
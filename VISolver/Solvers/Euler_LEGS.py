@@ -4,19 +4,21 @@ import numpy as np
 
 from VISolver.Projection import IdentityProjection
 from VISolver.Solver import Solver
-from VISolver.Utilities import GramSchmidt, Jv, Jv_num
+from VISolver.Utilities import OrthonormalizeQR, ReorthoDue, Jv, Jv_num
 
 
 class Euler_LEGS(Solver):
 
-    def __init__(self, Domain, P=IdentityProjection(), FixStep=False, 
-                 NTopLEs=None):
+    def __init__(self, Domain, P=IdentityProjection(), FixStep=False,
+                 NTopLEs=None, ReorthoEvery=1, ReorthoCond=None):
 
         self.F = Domain.F
 
-        try:
+        if hasattr(Domain,'Jv'):
+            self.Jv = Domain.Jv
+        elif hasattr(Domain,'Jac'):
             self.Jv = partial(Jv,Jac=Domain.Jac)
-        except AttributeError:
+        else:
             self.Jv = partial(Jv_num,F=self.F)
 
         self.Proj = P
@@ -29,6 +31,10 @@ class Euler_LEGS(Solver):
 
         self.NTopLEs = NTopLEs
 
+        self.ReorthoEvery = ReorthoEvery
+
+        self.ReorthoCond = ReorthoCond
+
     def InitTempStorage(self,Start,Domain,Options):
 
         self.TempStorage['Data'] = self.StorageSize*[Start]
@@ -46,6 +52,7 @@ class Euler_LEGS(Solver):
         self.TempStorage['dPsi'] = self.StorageSize*[dPsi_0.flatten()]
         self.TempStorage['Lyapunov'] = self.StorageSize*[np.zeros(self.NTopLEs)]
         self.TempStorage['T'] = self.StorageSize*[0]
+        self.TempStorage['T_QR'] = self.StorageSize*[0]
 
         self.TempStorage['scount'] = self.StorageSize*[0]
         self.TempStorage['s'] = self.StorageSize*[1]
@@ -66,6 +73,7 @@ class Euler_LEGS(Solver):
         Data_psi = Record.TempStorage['Psi'][-1]
         Lyapunov = Record.TempStorage['Lyapunov'][-1]
         T = Record.TempStorage['T'][-1]
+        T_QR = Record.TempStorage['T_QR'][-1]
         dim = Data_x.size
 
         F_x = Record.TempStorage[self.F][-1]
@@ -90,12 +98,15 @@ class Euler_LEGS(Solver):
         NewData_x = self.Proj.P(Data_x,Step,F_x)
         NewData_psi = (Data_psi+Step*F_psi).reshape((dim,-1))
 
-        # Orthogonalize Psi, Record Lyapunov Exponents, Normalize Psi
-        NewData_psi = GramSchmidt(NewData_psi,normalize=False)
-        LEDT = np.log(np.linalg.norm(NewData_psi,axis=0))
+        # Orthonormalize Psi (QR), Record Lyapunov Exponents
         Tnew = T + abs(Step)
-        NewLyapunov = (Lyapunov*T+LEDT)/Tnew
-        NewData_psi = NewData_psi/np.linalg.norm(NewData_psi,axis=0)
+        if ReorthoDue(NewData_psi,Record.thisPermIndex,
+                      self.ReorthoEvery,self.ReorthoCond):
+            NewData_psi, LEDT = OrthonormalizeQR(NewData_psi)
+            NewLyapunov = (Lyapunov*T_QR+LEDT)/Tnew
+            T_QR = Tnew
+        else:
+            NewLyapunov = Lyapunov
 
         # Store Data
         TempData['Data'] = NewData_x
@@ -104,6 +115,7 @@ class Euler_LEGS(Solver):
         TempData['dPsi'] = self.Jv(NewData_x,NewData_psi,F_Data=TempData[self.F]).flatten()
         TempData['Lyapunov'] = NewLyapunov
         TempData['T'] = Tnew
+        TempData['T_QR'] = T_QR
         TempData['scount'] = scount
         TempData['s'] = s
         TempData['Step'] = Step
@@ -1,13 +1,13 @@
 import numpy as np
 
 from VISolver.Projection import IdentityProjection
-from VISolver.Solver import Solver
+from VISolver.Solver import Solver, RejectSteps
 
 
 class HeunEuler(Solver):
 
     def __init__(self, Domain, P=IdentityProjection(), Delta0=1e-2,
-                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10):
+                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10, Control=None):
 
         self.F = Domain.F
 
@@ -25,6 +25,8 @@ class HeunEuler(Solver):
 
         self.MaxStep = MaxStep
 
+        self.Control = Control
+
     def InitTempStorage(self,Start,Domain,Options):
 
         self.TempStorage['Data'] = self.StorageSize*[Start]
@@ -32,6 +34,9 @@ class HeunEuler(Solver):
         self.TempStorage['Step'] = self.StorageSize*[Options.Init.Step]
         self.TempStorage['F Evaluations'] = self.StorageSize*[1]
         self.TempStorage['Projections'] = self.StorageSize*[0]
+        if self.Control is not None:
+            self.TempStorage['Error'] = self.StorageSize*[1.]
+            self.TempStorage['Rejections'] = self.StorageSize*[0]
 
         return self.TempStorage
 
@@ -41,31 +46,41 @@ class HeunEuler(Solver):
 
         # Retrieve Necessary Data
         Data = Record.TempStorage['Data'][-1]
-        Fs = np.zeros((2,Data.shape[0]),dtype=Data.dtype)
-        Fs[0,:] = Record.TempStorage[self.F][-1]
+        Fs = np.zeros((2,)+Data.shape,dtype=Data.dtype)
+        Fs[0] = Record.TempStorage[self.F][-1]
         Step = Record.TempStorage['Step'][-1]
 
         # Initialize Storage
         TempData = {}
 
         # Perform Update
-        _NewData = self.Proj.P(Data,Step,Fs[0,:])
-        Fs[1,:] = self.F(_NewData)
+        _NewData = self.Proj.P(Data,Step,Fs[0])
+        Fs[1] = self.F(_NewData)
         NewData = self.Proj.P(Data,Step,0.5*np.sum(Fs,axis=0))
 
-        # Adjust Stepsize
-        Delta = max(abs(NewData-_NewData))
-        if Delta == 0:
-            growth = self.GrowthLimit
+        # Adjust Stepsize (one step per row if Data is an (N,Dim) batch)
+        if self.Control is None:
+            Delta = np.max(abs(NewData-_NewData),axis=-1,
+                           keepdims=Data.ndim > 1)
+            with np.errstate(divide='ignore'):
+                growth = np.minimum((self.Delta0/Delta)**0.5,
+                                    self.GrowthLimit)
         else:
-            growth = min((self.Delta0/Delta)**0.5, self.GrowthLimit)
+            Accept, growth, Err = self.Control.Adjust(
+                Data,NewData,_NewData,self.TempStorage['Error'][-1],2)
+            NewData = RejectSteps(self,TempData,Accept,Data,NewData,Err)
         Step = np.clip(growth*Step,self.MinStep,self.MaxStep)
 
         # Store Data
         TempData['Data'] = NewData
-        TempData[self.F] = self.F(NewData)
+        if self.F in TempData:  # step rejected, F(Data) is reused
+            Evals = 1
+        else:
+            TempData[self.F] = self.F(NewData)
+            Evals = 2
         TempData['Step'] = Step
-        TempData['F Evaluations'] = 2 + self.TempStorage['F Evaluations'][-1]
+        TempData['F Evaluations'] = Evals + \
+            self.TempStorage['F Evaluations'][-1]
         TempData['Projections'] = 2 + self.TempStorage['Projections'][-1]
         self.BookKeeping(TempData)
 
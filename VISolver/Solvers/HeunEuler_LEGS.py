@@ -4,19 +4,22 @@ import numpy as np
 
 from VISolver.Projection import IdentityProjection
 from VISolver.Solver import Solver
-from VISolver.Utilities import GramSchmidt, Jv, Jv_num
+from VISolver.Utilities import OrthonormalizeQR, ReorthoDue, Jv, Jv_num
 
 
 class HeunEuler_LEGS(Solver):
 
     def __init__(self, Domain, P=IdentityProjection(), Delta0=1e-2,
-                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10, NTopLEs=None):
+                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10, NTopLEs=None,
+                 ReorthoEvery=1, ReorthoCond=None):
 
         self.F = Domain.F
 
-        try:
+        if hasattr(Domain,'Jv'):
+            self.Jv = Domain.Jv
+        elif hasattr(Domain,'Jac'):
             self.Jv = partial(Jv,Jac=Domain.Jac)
-        except AttributeError:
+        else:
             self.Jv = partial(Jv_num,F=self.F)
 
         self.Proj = P
@@ -35,6 +38,10 @@ class HeunEuler_LEGS(Solver):
 
         self.NTopLEs = NTopLEs
 
+        self.ReorthoEvery = ReorthoEvery
+
+        self.ReorthoCond = ReorthoCond
+
     def InitTempStorage(self,Start,Domain,Options):
 
         self.TempStorage['Data'] = self.StorageSize*[Start]
@@ -52,6 +59,7 @@ class HeunEuler_LEGS(Solver):
         self.TempStorage['dPsi'] = self.StorageSize*[dPsi_0.flatten()]
         self.TempStorage['Lyapunov'] = self.StorageSize*[np.zeros(self.NTopLEs)]
         self.TempStorage['T'] = self.StorageSize*[0]
+        self.TempStorage['T_QR'] = self.StorageSize*[0]
 
         self.TempStorage['Step'] = self.StorageSize*[Options.Init.Step]
         self.TempStorage['F Evaluations'] = self.StorageSize*[1]
@@ -68,6 +76,7 @@ class HeunEuler_LEGS(Solver):
         Data_psi = Record.TempStorage['Psi'][-1]
         Lyapunov = Record.TempStorage['Lyapunov'][-1]
         T = Record.TempStorage['T'][-1]
+        T_QR = Record.TempStorage['T_QR'][-1]
         dim = Data_x.size
 
         Fs_x = np.zeros((2,Data_x.shape[0]),dtype=Data_x.dtype)
@@ -95,13 +104,16 @@ class HeunEuler_LEGS(Solver):
         Delta_x = max(abs(NewData_x-_NewData_x))
         Delta_psi = max(abs(NewData_psi-_NewData_psi))
 
-        # Orthogonalize Psi, Record Lyapunov Exponents, Normalize Psi
+        # Orthonormalize Psi (QR), Record Lyapunov Exponents
         NewData_psi = NewData_psi.reshape((dim,-1))
-        NewData_psi = GramSchmidt(NewData_psi,normalize=False)
-        LEDT = np.log(np.linalg.norm(NewData_psi,axis=0))
         Tnew = T + abs(Step)
-        NewLyapunov = (Lyapunov*T+LEDT)/Tnew
-        NewData_psi = NewData_psi/np.linalg.norm(NewData_psi,axis=0)
+        if ReorthoDue(NewData_psi,Record.thisPermIndex,
+                      self.ReorthoEvery,self.ReorthoCond):
+            NewData_psi, LEDT = OrthonormalizeQR(NewData_psi)
+            NewLyapunov = (Lyapunov*T_QR+LEDT)/Tnew
+            T_QR = Tnew
+        else:
+            NewLyapunov = Lyapunov
 
         # Adjust Stepsize
         Delta = max(Delta_x,Delta_psi)
@@ -118,6 +130,7 @@ class HeunEuler_LEGS(Solver):
         TempData['dPsi'] = self.Jv(NewData_x,NewData_psi,F_Data=TempData[self.F]).flatten()
         TempData['Lyapunov'] = NewLyapunov
         TempData['T'] = Tnew
+        TempData['T_QR'] = T_QR
         TempData['Step'] = Step
         TempData['F Evaluations'] = 2 + self.TempStorage['F Evaluations'][-1]
         TempData['Projections'] = 2 + self.TempStorage['Projections'][-1]
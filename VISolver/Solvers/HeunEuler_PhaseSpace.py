@@ -7,7 +7,7 @@ from VISolver.Solver import Solver
 class HeunEuler_PhaseSpace(Solver):
 
     def __init__(self, Domain, P=IdentityProjection(), Delta0=1e-2,
-                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10):
+                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10, Control=None):
 
         self.F = Domain.F
 
@@ -25,6 +25,8 @@ class HeunEuler_PhaseSpace(Solver):
 
         self.MaxStep = MaxStep
 
+        self.Control = Control
+
         # self.DimWise = DimWise
 
     def InitTempStorage(self,Start,Domain,Options):
@@ -38,6 +40,9 @@ class HeunEuler_PhaseSpace(Solver):
         self.TempStorage['Step'] = self.StorageSize*[step]
         self.TempStorage['F Evaluations'] = self.StorageSize*[1]
         self.TempStorage['Projections'] = self.StorageSize*[0]
+        if self.Control is not None:
+            self.TempStorage['Error'] = self.StorageSize*[1.]
+            self.TempStorage['Rejections'] = self.StorageSize*[0]
 
         return self.TempStorage
 
@@ -96,7 +101,24 @@ class HeunEuler_PhaseSpace(Solver):
         # print('check1')
         # growth_est[Delta>0.] = (self.Delta0/Delta[Delta>0.])**0.5
         # print('check2')
-        if Delta == 0.:
+        if self.Control is not None:
+            Accept, growth_est, Err = self.Control.Adjust(
+                Data,NewData,_NewData,self.TempStorage['Error'][-1],2)
+            TempData['Error'] = Err
+            TempData['Rejections'] = int(not Accept) + \
+                self.TempStorage['Rejections'][-1]
+            if not Accept:
+                Step = np.clip(growth_est*Step,self.MinStep,self.MaxStep)
+                TempData['Data'] = Data
+                TempData[self.F] = Fs[0]
+                TempData['Step'] = Step
+                TempData['F Evaluations'] = 1 + \
+                    self.TempStorage['F Evaluations'][-1]
+                TempData['Projections'] = 2 + \
+                    self.TempStorage['Projections'][-1]
+                self.BookKeeping(TempData)
+                return self.TempStorage
+        elif Delta == 0.:
             growth_est = self.GrowthLimit
         else:
             growth_est = (self.Delta0/Delta)**0.5  # safety factor, theta, is set to 1
@@ -0,0 +1,147 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.linalg import lu_factor, lu_solve
+from scipy.sparse.linalg import splu
+
+from VISolver.Projection import IdentityProjection
+from VISolver.Solver import Solver, RejectSteps
+from VISolver.Utilities import approx_jacobian
+
+
+class RosenbrockW(Solver):
+
+    # Two stage linearly implicit ROS2 W-method (Verwer et al. 1999):
+    #   W = I - gamma*h*J,  W k1 = F(x),  W k2 = F(x+h*k1) - 2*k1
+    #   x+ = x + h*(3/2*k1 + 1/2*k2),  embedded x + h*k1
+    # As a W-method it stays 2nd order for any J, so the LU of W (and the
+    # Jacobian behind it) is reused across steps and only refreshed after
+    # MaxAge steps, a rejected step, or when the step has drifted by more
+    # than a factor of StepRatio from the one W was built with.
+    # The Jacobian comes from Domain.Jac, Domain.J, Domain.Jv or, failing
+    # those, forward differences.
+    def __init__(self, Domain, P=IdentityProjection(), Delta0=1e-2,
+                 GrowthLimit=2, MinStep=-1e10, MaxStep=1e10, MaxAge=20,
+                 StepRatio=2., Control=None):
+
+        self.F = Domain.F
+
+        if hasattr(Domain,'Jac'):
+            self.Jac = Domain.Jac
+        elif hasattr(Domain,'J'):
+            self.Jac = Domain.J
+        elif hasattr(Domain,'Jv'):
+            self.Jac = lambda Data: Domain.Jv(Data,np.eye(Data.size))
+        else:
+            self.Jac = lambda Data: approx_jacobian(self.F,Data)
+        self.JacFD = not any(hasattr(Domain,J) for J in ['Jac','J','Jv'])
+
+        self.Proj = P
+
+        self.StorageSize = 1
+
+        self.TempStorage = {}
+
+        self.Delta0 = Delta0
+
+        self.GrowthLimit = GrowthLimit
+
+        self.MinStep = MinStep
+
+        self.MaxStep = MaxStep
+
+        self.MaxAge = MaxAge
+
+        self.StepRatio = StepRatio
+
+        self.Control = Control
+
+        self.gamma = 1. + 1./np.sqrt(2.)
+
+        self.LU = None
+
+    def InitTempStorage(self,Start,Domain,Options):
+
+        self.TempStorage['Data'] = self.StorageSize*[Start]
+        self.TempStorage[self.F] = self.StorageSize*[self.F(Start)]
+        self.TempStorage['Step'] = self.StorageSize*[Options.Init.Step]
+        self.TempStorage['F Evaluations'] = self.StorageSize*[1]
+        self.TempStorage['Projections'] = self.StorageSize*[0]
+        self.TempStorage['Factorizations'] = self.StorageSize*[0]
+        if self.Control is not None:
+            self.TempStorage['Error'] = self.StorageSize*[1.]
+            self.TempStorage['Rejections'] = self.StorageSize*[0]
+
+        self.LU = None
+        self.Age = 0
+
+        return self.TempStorage
+
+    # BookKeeping(self,TempData) defined in super class 'Solver'
+
+    def Factorize(self,Data,Step):
+        J = self.Jac(Data)
+        if sp.issparse(J):
+            W = sp.identity(Data.size,format='csc') - self.gamma*Step*J
+            lu = splu(sp.csc_matrix(W))
+            self.LU = lu.solve
+        else:
+            W = np.identity(Data.size) - self.gamma*Step*np.asarray(J)
+            lu = lu_factor(W)
+            self.LU = lambda b: lu_solve(lu,b)
+        self.StepLU = Step
+        self.Age = 0
+        return Data.size if self.JacFD else 0
+
+    def Update(self,Record):
+
+        # Retrieve Necessary Data
+        Data = Record.TempStorage['Data'][-1]
+        F = Record.TempStorage[self.F][-1]
+        Step = Record.TempStorage['Step'][-1]
+
+        # Initialize Storage
+        TempData = {}
+
+        # Refactor W = I - gamma*h*J only when needed
+        Evals = 1
+        Factorizations = self.TempStorage['Factorizations'][-1]
+        if self.LU is None or self.Age >= self.MaxAge or \
+                not 1./self.StepRatio <= Step/self.StepLU <= self.StepRatio:
+            Evals += self.Factorize(Data,Step)
+            Factorizations += 1
+        self.Age += 1
+
+        # Perform Update
+        k1 = self.LU(F)
+        _NewData = self.Proj.P(Data,Step,k1)
+        k2 = self.LU(self.F(_NewData) - 2.*k1)
+        NewData = self.Proj.P(Data,Step,1.5*k1+0.5*k2)
+
+        # Adjust Stepsize
+        if self.Control is None:
+            Delta = max(abs(NewData-_NewData))
+            with np.errstate(divide='ignore',over='ignore'):
+                growth = min((self.Delta0/Delta)**0.5, self.GrowthLimit)
+        else:
+            Accept, growth, Err = self.Control.Adjust(
+                Data,NewData,_NewData,self.TempStorage['Error'][-1],2)
+            NewData = RejectSteps(self,TempData,Accept,Data,NewData,Err)
+        Step = np.clip(growth*Step,self.MinStep,self.MaxStep)
+
+        # Error overshot its target (or the step was rejected): W may be stale
+        if np.any(growth < 0.9):
+            self.LU = None
+
+        # Store Data
+        TempData['Data'] = NewData
+        if self.F not in TempData:
+            TempData[self.F] = self.F(NewData)
+            Evals += 1
+        TempData['Step'] = Step
+        TempData['F Evaluations'] = Evals + \
+            self.TempStorage['F Evaluations'][-1]
+        TempData['Projections'] = 2 + self.TempStorage['Projections'][-1]
+        TempData['Factorizations'] = Factorizations
+        self.BookKeeping(TempData)
+
+        return self.TempStorage
@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class StepControl(object):
+
+    # Error-based step control shared by the adaptive solvers. The local
+    # error |NewData-_NewData| is scaled per component by Atol + Rtol*|x|;
+    # steps with scaled error > 1 are rejected, and accepted steps are
+    # resized by a PI (Gustafsson) controller on the current and previous
+    # errors. Pass as Control=StepControl(...) to HeunEuler, CashKarp, etc.
+    def __init__(self,Atol=1e-6,Rtol=1e-3,Safety=0.9,GrowthLimit=2.,
+                 ShrinkLimit=0.2,Alpha=0.7,Beta=0.4):
+        self.Atol = Atol
+        self.Rtol = Rtol
+        self.Safety = Safety
+        self.GrowthLimit = GrowthLimit
+        self.ShrinkLimit = ShrinkLimit
+        self.Alpha = Alpha
+        self.Beta = Beta
+
+    def Error(self,Data,NewData,_NewData):
+        # one error per row if Data is an (N,Dim) batch
+        scale = self.Atol + self.Rtol*np.maximum(abs(Data),abs(NewData))
+        return np.max(abs(NewData-_NewData)/scale,axis=-1,
+                      keepdims=Data.ndim > 1)
+
+    def Adjust(self,Data,NewData,_NewData,ErrPrev,order):
+        '''Returns (Accept, growth, Err) for a step whose error estimate
+        compares methods of orders order-1 and order.'''
+        Err = np.maximum(self.Error(Data,NewData,_NewData),1e-10)
+        Accept = Err <= 1.
+        # PI controller on accepted steps, plain I controller on rejections
+        growth = np.where(Accept,
+                          Err**(-self.Alpha/order)*ErrPrev**(self.Beta/order),
+                          Err**(-1./order))
+        growth = np.clip(self.Safety*growth,self.ShrinkLimit,self.GrowthLimit)
+        # never grow right after a rejection
+        growth = np.where(Accept,growth,np.minimum(growth,1.))
+        Err = np.where(Accept,Err,ErrPrev)
+        return Accept, growth, Err
@@ -1,3 +1,10 @@
+import glob
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
 try:
     import progressbar  # pip install progressbar2
     bar = progressbar.ProgressBar(max_value=progressbar.UnknownLength)
@@ -5,6 +12,210 @@ except ImportError:
     bar = None
 
 
+class RingBuffer(object):
+
+    # Fixed-size history: append overwrites the oldest entry in place
+    def __init__(self,items):
+        self.items = list(items)
+        self.size = len(self.items)
+        self.head = 0
+
+    def append(self,item):
+        self.items[self.head] = item
+        self.head = (self.head + 1) % self.size
+
+    def _index(self,i):
+        if i < -self.size or i >= self.size:
+            raise IndexError('RingBuffer index out of range')
+        return (self.head + i) % self.size
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return list(self)[i]
+        return self.items[self._index(i)]
+
+    def __setitem__(self,i,item):
+        self.items[self._index(i)] = item
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.items[(self.head + i) % self.size]
+
+
+def RecordDtype(item):
+    # Integer records are widened to float up front so that e.g. Step=0
+    # followed by fractional steps is not truncated
+    if item.dtype.kind in 'iu':
+        return np.result_type(item.dtype,float)
+    return item.dtype
+
+
+class ArrayBuffer(object):
+
+    # Contiguous record of equally shaped items, grown geometrically
+    def __init__(self,item,capacity=1,growth=2):
+        item = np.asarray(item)
+        self.data = np.empty((max(int(capacity),1),)+item.shape,
+                             dtype=RecordDtype(item))
+        self.length = 0
+        self.growth = growth
+        self.append(item)
+
+    def append(self,item):
+        item = np.asarray(item)
+        dtype = np.promote_types(self.data.dtype,item.dtype)
+        if dtype != self.data.dtype:
+            self.data = self.data.astype(dtype)
+        if self.length == self.data.shape[0]:
+            capacity = int(np.ceil(self.growth*self.data.shape[0]))
+            data = np.empty((capacity,)+self.data.shape[1:],
+                            dtype=self.data.dtype)
+            data[:self.length] = self.data[:self.length]
+            self.data = data
+        self.data[self.length] = item
+        self.length += 1
+
+    def array(self):
+        return self.data[:self.length]
+
+    def __getitem__(self,i):
+        return self.array()[i]
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.array())
+
+
+class ChunkedArray(object):
+
+    # Read-only, lazily loaded view of a record saved as .npy chunk files
+    def __init__(self,files=()):
+        self.files = []
+        self.chunks = []
+        self.offsets = [0]
+        for f in files:
+            self.extend(f)
+
+    def extend(self,f):
+        chunk = np.load(f,mmap_mode='r')
+        self.files.append(f)
+        self.chunks.append(chunk)
+        self.offsets.append(self.offsets[-1]+chunk.shape[0])
+
+    @property
+    def shape(self):
+        return (len(self),)+self.chunks[0].shape[1:]
+
+    @property
+    def dtype(self):
+        return np.result_type(*self.chunks)
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self,key):
+        rest = ()
+        if isinstance(key,tuple):
+            key, rest = key[0], key[1:]
+        if isinstance(key,(int,np.integer)):
+            if key < 0:
+                key += len(self)
+            if key < 0 or key >= len(self):
+                raise IndexError('ChunkedArray index out of range')
+            c = np.searchsorted(self.offsets,key,side='right')-1
+            return np.array(self.chunks[c][(key-self.offsets[c],)+rest])
+        # Gather rows chunk by chunk so only the touched pages are read
+        idx = np.arange(len(self))[key]
+        c = np.searchsorted(self.offsets,idx,side='right')-1
+        out = np.empty((len(idx),)+self.shape[1:],dtype=self.dtype)
+        for k in np.unique(c):
+            out[c == k] = self.chunks[k][idx[c == k]-self.offsets[k]]
+        return out[(slice(None),)+rest]
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            for item in chunk:
+                yield np.array(item)
+
+    def __array__(self,dtype=None,copy=None):
+        arr = np.concatenate(self.chunks) if self.chunks else np.empty(0)
+        return arr if dtype is None else arr.astype(dtype)
+
+
+class StreamBuffer(object):
+
+    # Records items in memory and flushes them to disk every Flush items
+    def __init__(self,item,prefix,flush=1000):
+        item = np.asarray(item)
+        self.prefix = prefix
+        # Chunks numbered from zero again, so drop any left in the Sink by
+        # an earlier run or LoadRecord would append them to this one
+        for f in glob.glob(prefix+'_'+'[0-9]'*6+'.npy'):
+            os.remove(f)
+        self.chunk = np.empty((max(int(flush),1),)+item.shape,
+                              dtype=RecordDtype(item))
+        self.count = 0
+        self.stored = ChunkedArray()
+        self.append(item)
+
+    def append(self,item):
+        item = np.asarray(item)
+        dtype = np.promote_types(self.chunk.dtype,item.dtype)
+        if dtype != self.chunk.dtype:
+            self.chunk = self.chunk.astype(dtype)
+        self.chunk[self.count] = item
+        self.count += 1
+        if self.count == self.chunk.shape[0]:
+            self.flush()
+
+    def flush(self):
+        if self.count > 0:
+            f = '%s_%06d.npy' % (self.prefix,len(self.stored.files))
+            np.save(f,self.chunk[:self.count])
+            self.stored.extend(f)
+            self.count = 0
+
+    def __len__(self):
+        return len(self.stored)+self.count
+
+    def __getitem__(self,i):
+        if isinstance(i,(int,np.integer)):
+            if i < 0:
+                i += len(self)
+            if i >= len(self.stored):
+                return self.chunk[i-len(self.stored)]
+            return self.stored[i]
+        self.flush()
+        return self.stored[i]
+
+
+def RecordName(req):
+    if hasattr(req,'__name__'):
+        req = req.__name__
+    return str(req).replace(' ','_')
+
+
+def LoadRecord(Sink):
+    # Reopen every request streamed to the Sink directory as a ChunkedArray
+    files = sorted(glob.glob(os.path.join(Sink,'*_[0-9][0-9][0-9][0-9][0-9][0-9].npy')))
+    names = sorted(set(os.path.basename(f)[:-11] for f in files))
+    return {name: ChunkedArray([f for f in files
+                                if os.path.basename(f)[:-11] == name])
+            for name in names}
+
+
+def Evaluate(req,Data):
+    # Domain functions act on single points, so evaluate batches by row
+    if Data.ndim > 1:
+        return np.array([req(row) for row in Data])
+    return req(Data)
+
+
 class Storage(object):
 
     def __init__(self,Start,Domain,Method,Options):
@@ -13,6 +224,11 @@ class Storage(object):
         self.thisPermIndex = 0
 
         self.Interval = Options.Repo.Interval
+        self.Prealloc = Options.Repo.Prealloc
+        self.Sink = Options.Repo.Sink
+        if self.Sink is not None and not os.path.isdir(self.Sink):
+            os.makedirs(self.Sink)
+        Capacity = int(Options.Term.Tols[0])//self.Interval + 1
 
         self.TempStorage = Method.InitTempStorage(Start,Domain,Options)
 
@@ -21,10 +237,34 @@ class Storage(object):
             if req in Method.TempStorage:
                 PermItem = Method.TempStorage[req][-1]
             else:
-                PermItem = req(Start)
-            self.PermStorage[req] = [PermItem]
+                PermItem = self.Evaluate(req,Start)
+            if self.Sink is not None:
+                prefix = os.path.join(self.Sink,RecordName(req))
+                self.PermStorage[req] = StreamBuffer(PermItem,prefix,
+                                                     Options.Repo.Flush)
+            elif self.Prealloc:
+                self.PermStorage[req] = ArrayBuffer(PermItem,Capacity)
+            else:
+                self.PermStorage[req] = [PermItem]
+
+        # Requests not needed for termination can be evaluated off the main
+        # loop; results are drained into PermStorage in iteration order
+        self.Pool = None
+        self.Pending = {}
+        self.Errors = {}
+        TermRequests = [tol[0] for tol in Options.Term.Tols[1]]
+        AsyncRequests = [req for req in self.PermStorage
+                         if req not in Method.TempStorage and
+                         req not in TermRequests]
+        if Options.Repo.Workers > 0 and AsyncRequests:
+            if Options.Repo.Executor == 'process':
+                self.Pool = ProcessPoolExecutor(Options.Repo.Workers)
+            else:
+                self.Pool = ThreadPoolExecutor(Options.Repo.Workers)
+            self.Pending = {req: deque() for req in AsyncRequests}
 
         self.Timer = Options.Misc.Timer
+        self.Profile = None
 
     def BookKeeping(self,TempStorage):
 
@@ -40,10 +280,50 @@ class Storage(object):
             if self.thisPermIndex % self.Interval == 0:
                 if req in self.TempStorage:
                     PermItem = self.TempStorage[req][-1]
+                elif req in self.Pending:
+                    self.Pending[req].append(
+                        (self.thisPermIndex,
+                         self.Pool.submit(Evaluate,req,NewData.copy())))
+                    continue
                 else:
-                    PermItem = req(NewData)
+                    PermItem = self.Evaluate(req,NewData)
                 self.PermStorage[req].append(PermItem)
+        self.Collect()
 
         # Update Progress Bar
         if bar and self.Timer:
             bar.update(self.thisPermIndex)
+
+    def Evaluate(self,req,Data):
+        return Evaluate(req,Data)
+
+    def Collect(self,wait=False):
+        # Move finished async results into PermStorage, oldest first
+        # A request that raised is reported and left out of PermStorage, so
+        # Finalize never re-raises it outside Solve's own error handling
+        for req, pending in self.Pending.items():
+            while pending and (wait or pending[0][1].done()):
+                index, future = pending.popleft()
+                try:
+                    self.PermStorage[req].append(future.result())
+                except Exception as e:
+                    print('%s failed at iteration %d: %r' %
+                          (RecordName(req), index, e))
+                    self.Errors.setdefault(req,[]).append((index,e))
+
+    def Finalize(self):
+        if self.Profile is not None:
+            self.Profile.Detach()
+        if self.Pool is not None:
+            self.Collect(wait=True)
+            self.Pool.shutdown()
+            self.Pool = None
+            self.Pending = {}
+        # Hand preallocated records back as trimmed (T,...) arrays and
+        # streamed records back as lazily loaded chunk readers
+        for req in self.PermStorage:
+            if isinstance(self.PermStorage[req],ArrayBuffer):
+                self.PermStorage[req] = self.PermStorage[req].array()
+            elif isinstance(self.PermStorage[req],StreamBuffer):
+                self.PermStorage[req].flush()
+                self.PermStorage[req] = self.PermStorage[req].stored
@@ -19,7 +19,7 @@ def GramSchmidt(A,normalize=True):
     U = A.copy()
 
     if U.shape[1] > 1:
-        comp = U.dtype == np.complex
+        comp = np.iscomplexobj(U)
         for i in range(U.shape[1]):
             vi = A[:,i]
             proj = 0*vi
@@ -33,6 +33,28 @@ def GramSchmidt(A,normalize=True):
     return U
 
 
+def OrthonormalizeQR(A):
+    # Reduced QR with diag(R) >= 0, i.e. the normalized Gram-Schmidt basis;
+    # log|diag(R)| is the log growth of each direction since the last call
+    Q, R = np.linalg.qr(A)
+    d = np.diag(R)
+    s = np.where(d < 0,-1.,1.)
+    return Q*s, np.log(np.abs(d))
+
+
+def ReorthoDue(Psi,Iter,Every=1,CondMax=None):
+    if (Iter+1) % Every == 0:
+        return True
+    if CondMax is None:
+        return False
+    # cond(Psi) from the eigenvalues of the small (k,k) Gram matrix rather
+    # than an SVD of Psi; unlike the spread of the column norms this also
+    # sees columns collapsing onto the leading direction
+    G = np.dot(Psi.T.conj(),Psi)
+    ev = np.linalg.eigvalsh(G)
+    return not ev[0]*CondMax**2 >= ev[-1]
+
+
 def dot(a,b,comp=False):
     if comp:
         return np.dot(a,np.conj(b))
@@ -75,7 +97,7 @@ def approx_jacobian(F,x,epsilon=np.sqrt(np.finfo(float).eps),*args):
 
     """
     func = F
-    x0 = np.asfarray(x)
+    x0 = np.asarray(x,dtype=float)
     f0 = func(*((x0,)+args))
     jac = np.zeros([len(x0),len(f0)])
     dx = np.zeros(len(x0))
@@ -87,6 +109,8 @@ def approx_jacobian(F,x,epsilon=np.sqrt(np.finfo(float).eps),*args):
 
 
 def ListONP2NP(L):
+    if isinstance(L,np.ndarray):
+        return L
     arr = np.empty((len(L),)+L[0].shape)
     for idx,x in enumerate(L):
         arr[idx] = x